@@ -1,3 +1,7 @@
+from utils.resources import configure_threads
+
+configure_threads()     # Before anything imports polars, so each worker's polars pool fits its CPU budget
+
 import dash
 from dash import html, Dash, dcc
 import dash_bootstrap_components as dbc
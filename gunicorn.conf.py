@@ -0,0 +1,26 @@
+import itertools
+import os
+
+from utils.resources import PIN_WORKERS, pin_worker
+
+
+def on_starting(server):
+    # Workers inherit the environment, so utils.resources can split the CPUs between them
+    os.environ.setdefault("OFTW_WORKERS", str(server.cfg.workers))
+
+
+def pre_fork(server, worker):
+    # Runs in the arbiter, where server.WORKERS holds the live workers (an exited one is reaped before its
+    # replacement is spawned). worker.age keeps growing across respawns, so each new worker takes the lowest
+    # CPU share no live worker holds instead, i.e. the share of the worker it replaces
+    taken = {getattr(w, "cpu_share", None) for w in server.WORKERS.values()}
+    worker.cpu_share = next(i for i in itertools.count() if i not in taken)
+
+
+def post_fork(server, worker):
+    if PIN_WORKERS:
+        cpus = pin_worker(worker.cpu_share, server.cfg.workers)
+        if cpus:
+            # The worker's polars pool matches its pinned CPUs (set before the app imports polars)
+            os.environ.setdefault("POLARS_MAX_THREADS", str(len(cpus)))
+        server.log.info(f"Worker {worker.pid} pinned to CPUs {sorted(cpus) if cpus else 'unavailable'}")
@@ -1,6 +1,8 @@
 from dash import html, dcc
 import dash_bootstrap_components as dbc
 
+import uuid
+
 import dash_draggable
 
 from utils.data_preparer import DataPreparer
@@ -8,17 +10,6 @@ from utils.data_loader import data_loader
 
 data_preparer = DataPreparer()
 
-unique_fy = data_preparer.get_col_unique_values(
-    "merged", "payment_date_fy", sort_desc=True
-)
-
-unique_platforms = data_preparer.get_col_unique_values("merged", "payment_platform")
-unique_chapter_types = data_preparer.get_col_unique_values(
-    "merged", "pledge_chapter_type"
-)
-
-last_payment_date = data_preparer.get_column_max_value("payments", "payment_date")
-
 drilldown_by = [
     {"label": "Payment Platform", "value": "payment_platform"},
     {"label": "Source (Chapter Types)", "value": "pledge_chapter_type"},
@@ -112,8 +103,17 @@ def chart_header_title_with_ai(chart_id, title):
 
 
 def moneymoved_layout():
+    # Answered from the data loader's statistics catalog, so they follow data reloads
+    unique_fy = data_preparer.get_col_unique_values(
+        "merged", "payment_date_fy", sort_desc=True
+    )
+
+    last_payment_date = data_preparer.get_column_max_value("payments", "payment_date")
+
     return html.Div(
         children=[
+            # Identifies the browser tab, so a newer refresh of a chart cancels the tab's older one still running
+            dcc.Store(id="session-id", storage_type="session", data=str(uuid.uuid4())),
             html.Div(
                 className="layout-navbar-fixed layout-menu-fixed layout-wide",
                 dir="ltr",
@@ -1,5 +1,6 @@
 import dash
 from dash import Input, Output, callback, ctx, html, ALL, State, dcc
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 
 import polars as pl
@@ -10,6 +11,12 @@ import plotly.graph_objects as go
 from utils.data_loader import data_loader
 from utils.data_preparer import DataPreparer
 from utils.figure import Figure
+from utils.fiscal_calendar import fiscal_calendar
+from utils.cube import money_moved_cube, pledge_donor_cube
+from utils.rollups import money_moved_rollups
+from utils.task_graph import TaskGraph
+from utils.admission import admit
+from utils.cancellation import cancellable
 
 from pages.layouts import moneymoved_layout
 
@@ -29,16 +36,29 @@ colors = {
     'white': '#FFFFFF'
 }
 
+# Cube dimensions the money moved charts read (the cube also returns the summed payment_amount_usd and payment_cf_amount_usd)
+money_moved_columns = [
+    "payment_date_fy", "payment_date_fm", "payment_date_calendar_month", "payment_date_calendar_monthyear",
+    "pledge_chapter_type", "payment_portfolio", "payment_platform", "pledge_frequency_type"
+]
+
 def layout(**kwargs):
     return moneymoved_layout()
 
 
+def keep_current_output(*args, **kwargs):
+    # A refresh that was not admitted in time, was superseded by a newer one or passed its deadline
+    # leaves the current cards and charts in place
+    raise PreventUpdate
+
+
 @callback(
     Output("active-donors-card", "children"),
     Output("active-pledges-card", "children"),
     Input("fy-filter", "value"),
     Input("target-form-data-store", "data"),
 )
+@admit("interactive", on_timeout = keep_current_output)
 def active_donors_pledges_card(selected_fy, target_form_data):
     filters = []     
 
@@ -52,17 +72,9 @@ def active_donors_pledges_card(selected_fy, target_form_data):
     if selected_fy:
         filters.append(("pledge_starts_at_fy", "==", selected_fy))
 
-    pledges_lf = data_preparer.filter_data("pledges", filters)
-
-    active_donors_value = (pledges_lf
-        .filter(pl.col("pledge_status").is_in(["Active donor", "One-Time"]))
-        .pipe(lambda lf: data_preparer.get_unique_col_count_lf(lf, "pledge_donor_id"))
-    )
-
-    active_pledges_value = (pledges_lf
-        .filter(pl.col("pledge_status").is_in(["Active donor"]))
-        .pipe(lambda lf: data_preparer.get_unique_col_count_lf(lf, "pledge_donor_id"))
-    )
+    # Distinct donors are counted by merging the per-cell donor sketches of pledges
+    active_donors_value = pledge_donor_cube.count_distinct(filters + [("pledge_status", "in", ["Active donor", "One-Time"])])
+    active_pledges_value = pledge_donor_cube.count_distinct(filters + [("pledge_status", "in", ["Active donor"])])
 
     active_donors_card = figure_instance.create_absolute_value_kpi_card(active_donors_value, goal = ACTIVE_DONORS_TARGET, body_text = "Active Donors")
     active_pledges_card = figure_instance.create_absolute_value_kpi_card(active_pledges_value, goal = ACTIVE_PLEDGES_TARGET, body_text = "Active Pledges")
@@ -89,10 +101,13 @@ def active_donors_pledges_card(selected_fy, target_form_data):
     Input({"type": "ai-icon", "chart": ALL}, "n_clicks"),
     [
         State("ai-message-store", "data"),
+        State("session-id", "data"),
     ],
     prevent_initial_call = "initial_duplicate"
 )
-def update_kpis_graphs(selected_fy, selected_amount_type, topn_donor_chapter_value, target_form_data, ai_icon_clicks_list, existing_ai_messages):
+@cancellable(on_cancel = keep_current_output)
+@admit("heavy", on_timeout = keep_current_output)
+def update_kpis_graphs(selected_fy, selected_amount_type, topn_donor_chapter_value, target_form_data, ai_icon_clicks_list, existing_ai_messages, session_id = None):
     triggered_id = ctx.triggered_id
     chart_insight = None
 
@@ -102,7 +117,7 @@ def update_kpis_graphs(selected_fy, selected_amount_type, topn_donor_chapter_val
         chart_insight = triggered_id.get("chart")
 
     filters = []     
-    prior_fy_value = f"FY{int(selected_fy[2:6]) - 1}-{int(selected_fy[7:]) - 1}"
+    prior_fy_value = fiscal_calendar.prior_fy(selected_fy)
     sy_py_filters = [("payment_date_fy", "in", [selected_fy, prior_fy_value])]
 
     if len(target_form_data) > 0:
@@ -121,29 +136,22 @@ def update_kpis_graphs(selected_fy, selected_amount_type, topn_donor_chapter_val
     # if selected_chapter_type:
     #     filters.append(("pledge_chapter_type", "in", selected_chapter_type))
 
-    merged_lf = data_preparer.filter_data("merged", filters)
+    merged_lf = money_moved_cube.filter_data(filters, columns = money_moved_columns)
 
     money_moved_lf = (merged_lf
-                   .select(["payment_date_fy", "payment_date_fm", "payment_date_calendar_year", "payment_date_calendar_month", "payment_date_calendar_monthname", 
-                            "payment_date_calendar_monthyear", "payment_date_day_of_week", "payment_date_week_of_fy", "pledge_status", "pledge_chapter_type", 
-                            "payment_portfolio", "payment_platform", "payment_date", "payment_amount_usd", "payment_cf_amount_usd", "pledge_frequency_type"
-                    ])
                    .filter(~pl.col("payment_portfolio").is_in(["One for the World Discretionary Fund", "One for the World Operating Costs"]))
                    .sort("payment_date_fm")
                 )
 
-    # mm FYTD
-    money_moved_ytd_value = money_moved_lf.select(pl.col("payment_amount_usd").sum()).collect().item()
-    mm_card = figure_instance.create_kpi_card(money_moved_ytd_value, goal = fund_raise_target, body_text = "Money Moved FYTD")
-
-    # cf mm FYTD
-    cf_money_moved_ytd_value = money_moved_lf.select(pl.col("payment_cf_amount_usd").sum()).collect().item()
-    cf_mm_card = figure_instance.create_kpi_card(cf_money_moved_ytd_value, goal = cf_fund_raise_target, body_text = "CF Money Moved FYTD")
-
+    # mm FYTD and cf mm FYTD
+    money_moved_ytd_lf = money_moved_lf.select([
+        pl.col("payment_amount_usd").sum().alias("money_moved_ytd"),
+        pl.col("payment_cf_amount_usd").sum().alias("cf_money_moved_ytd"),
+    ])
 
     # money moved monthly
     # dumbell_chart_filters = [("payment_date_fy", "in", [selected_fy, prior_fy_value])]
-    money_moved_ytd_df = (merged_lf
+    money_moved_ytd_monthly_lf = (merged_lf
         .group_by(["payment_date_fy", "payment_date_fm", "payment_date_calendar_month", "payment_date_calendar_monthyear"])
         .agg([
             pl.col("payment_amount_usd").sum().alias("money_moved_monthly"),
@@ -155,13 +163,9 @@ def update_kpis_graphs(selected_fy, selected_amount_type, topn_donor_chapter_val
             pl.cum_sum("cf_money_moved_monthly").alias("cf_money_moved_cumulative"),
         ])
         # .select(["payment_date_fm", "payment_date_calendar_monthyear", "money_moved_cumulative", "cf_money_moved_cumulative"])
-        .collect()
     )
 
-    # print(money_moved_ytd_df)
-
-    money_moved_py_df = (data_loader.get_data("merged")
-        .filter(pl.col("payment_date_fy") == prior_fy_value)
+    money_moved_py_lf = (money_moved_cube.filter_data([("payment_date_fy", "==", prior_fy_value)], columns = money_moved_columns)
         .filter(~pl.col("payment_portfolio").is_in(["One for the World Discretionary Fund", "One for the World Operating Costs"]))
         .group_by(["payment_date_fy", "payment_date_fm", "payment_date_calendar_month", "payment_date_calendar_monthyear"])
         .agg([
@@ -178,25 +182,10 @@ def update_kpis_graphs(selected_fy, selected_amount_type, topn_donor_chapter_val
             pl.cum_sum("cf_monthly_target_runrate").alias("cf_money_moved_cumulative"),
         ])
         # .drop(["money_moved_monthly", "cf_money_moved_monthly"])
-        .collect()
     )
 
-    # print(money_moved_py_df)
-    
-    # Generate cell grid plot
-    # cell_grid_fig = figure_instance.create_cell_grid_graph(money_moved_ytd_df, money_moved_py_df)
-
-    mm_monthly_fig = go.Figure()
-
-    if "cf" in selected_amount_type:
-        mm_monthly_fig = figure_instance.create_monthly_mm_graph(money_moved_ytd_df, "cf_money_moved_cumulative", cf_fund_raise_target, money_moved_py_df)
-    else:
-        mm_monthly_fig = figure_instance.create_monthly_mm_graph(money_moved_ytd_df, "money_moved_cumulative", fund_raise_target, money_moved_py_df)
-
-    # mm_mosaic_fig = figure_instance.create_money_mural_mosaic(money_moved_ytd_df)
-
-    # Recurring vs One-Time bar graph
-    money_moved_reoccuring_df = (money_moved_lf
+    # Recurring vs One-Time
+    money_moved_reoccuring_lf = (money_moved_lf
             .group_by(["payment_date_fm", "payment_date_calendar_month", "payment_date_calendar_monthyear", "pledge_frequency_type"])
             .agg([
                 pl.col("payment_amount_usd").sum().alias("money_moved_usd"),
@@ -208,64 +197,127 @@ def update_kpis_graphs(selected_fy, selected_amount_type, topn_donor_chapter_val
             # .with_columns([
             #     pl.col("money_moved_monthly").cum_sum().over(["pledge_frequency_type"]).alias("money_moved_usd_cumulative"),
             # ])
-            .collect()  
         )
-            
-    reoccuring_vs_onetime_fig = figure_instance.create_reoccuring_vs_onetime_bar_graph(money_moved_reoccuring_df)
-    # End of recurring vs one-time bar graph
-
-    # Top N Donor Chapter Dumbell Chart (Selected FY vs Prior FY)
-
-    money_moved_top_n_donors_df_pd = (data_preparer.filter_data("merged", sy_py_filters)
-        .collect()
-        .pivot(
-            values="payment_amount_usd",  # Replace with the column you want to aggregate
-            index=["pledge_donor_chapter"],  # Replace with the columns you want as index
-            on="payment_date_fy",
-            aggregate_function="sum"  # Replace with the aggregation function you need
-        )    
-        .rename({
-            selected_fy: "selected_fy",
-            prior_fy_value: "prior_fy"
-        })
-        .filter(pl.col("pledge_donor_chapter").is_not_null())
-        .with_columns([
-            pl.col("selected_fy").fill_null(0),
-            pl.col("prior_fy").fill_null(0),
-        ])
-        .with_columns([
-            (pl.col("selected_fy") + pl.col("prior_fy")).alias("total")
-        ])
-        .sort("total", descending=True)
-        .to_pandas()                         
+
+    # Top N Donor Chapter (Selected FY vs Prior FY)
+    money_moved_top_n_donors_lf = (money_moved_cube.filter_data(sy_py_filters, columns = ["pledge_donor_chapter", "payment_date_fy"])
+        .select(["pledge_donor_chapter", "payment_date_fy", "payment_amount_usd"])
     )
 
-    if len(money_moved_top_n_donors_df_pd) > topn_donor_chapter_value:
-        top = money_moved_top_n_donors_df_pd.head(topn_donor_chapter_value)
-        other = money_moved_top_n_donors_df_pd.iloc[topn_donor_chapter_value:]
-        other_row = pd.DataFrame({
-            "pledge_donor_chapter": ["Other"],
-            "selected_fy": [other["selected_fy"].sum()],
-            "prior_fy": [other["prior_fy"].sum()],
-            "total": [other["total"].sum()]
-        })
-        top = pd.concat([top, other_row], ignore_index=True)
-    else:
-        top = money_moved_top_n_donors_df_pd
+    # Collect every query in one pass, so the shared FY slices of the cube are scanned once
+    query_results = data_preparer.collect_batch({
+        "ytd": money_moved_ytd_lf,
+        "ytd_monthly": money_moved_ytd_monthly_lf,
+        "py_monthly": money_moved_py_lf,
+        "reoccuring": money_moved_reoccuring_lf,
+        "top_n_donors": money_moved_top_n_donors_lf,
+    })
 
-    # Move "Unknown" to bottom after sorting
-    top_sorted = top.sort_values(by="total", ascending=False)
-    top_sorted["sort_key"] = top_sorted.apply(
-        lambda row: -1 if row["pledge_donor_chapter"] == "Unknown" or row["pledge_donor_chapter"] == "Other" else row["total"], axis=1
-    )
-    top_sorted = top_sorted.sort_values(by="sort_key", ascending=False).drop(columns="sort_key")
+    # Independent charts are built concurrently on the shared chart pool; the callback joins them at the end
+    def create_kpi_cards(money_moved_ytd_df):
+        money_moved_ytd_value, cf_money_moved_ytd_value = money_moved_ytd_df.row(0)
+
+        # Prior FY as of the same day of the year as the latest payment, from the FYTD prefix sums
+        excluded_portfolios = ["One for the World Discretionary Fund", "One for the World Operating Costs"]
+        mm_vs_prior = money_moved_rollups.fytd_vs_prior(selected_fy, "payment_amount_usd", excluded_portfolios)
+        cf_mm_vs_prior = money_moved_rollups.fytd_vs_prior(selected_fy, "payment_cf_amount_usd", excluded_portfolios)
+        prior_text = f"{prior_fy_value} to {mm_vs_prior[2]:%d %b}" if mm_vs_prior else None
 
-    # Get the donor chapter ordering for the y-axis
-    donor_order = top_sorted["pledge_donor_chapter"].tolist()[::-1]    
+        mm_card = figure_instance.create_kpi_card(money_moved_ytd_value, goal = fund_raise_target, body_text = "Money Moved FYTD",
+                                                  prior_value = mm_vs_prior[1] if mm_vs_prior else None, prior_text = prior_text)
+        cf_mm_card = figure_instance.create_kpi_card(cf_money_moved_ytd_value, goal = cf_fund_raise_target, body_text = "CF Money Moved FYTD",
+                                                     prior_value = cf_mm_vs_prior[1] if cf_mm_vs_prior else None, prior_text = prior_text)
 
-    dumbell_chart_fig = figure_instance.create_dumbell_chart_w_logo(top_sorted, selected_fy, prior_fy_value, donor_order)
+        return mm_card, cf_mm_card
 
-    #End of Top N Donor Chapter Dumbell Chart
+    def create_monthly_graph(money_moved_ytd_df, money_moved_py_df):
+        # Generate cell grid plot
+        # cell_grid_fig = figure_instance.create_cell_grid_graph(money_moved_ytd_df, money_moved_py_df)
+
+        mm_monthly_fig = go.Figure()
+
+        if "cf" in selected_amount_type:
+            mm_monthly_fig = figure_instance.create_monthly_mm_graph(money_moved_ytd_df, "cf_money_moved_cumulative", cf_fund_raise_target, money_moved_py_df)
+        else:
+            mm_monthly_fig = figure_instance.create_monthly_mm_graph(money_moved_ytd_df, "money_moved_cumulative", fund_raise_target, money_moved_py_df)
+
+        # mm_mosaic_fig = figure_instance.create_money_mural_mosaic(money_moved_ytd_df)
+
+        return mm_monthly_fig
+
+    def create_reoccuring_graph(money_moved_reoccuring_df):
+        # Recurring vs One-Time bar graph
+            
+        reoccuring_vs_onetime_fig = figure_instance.create_reoccuring_vs_onetime_bar_graph(money_moved_reoccuring_df)
+
+        return reoccuring_vs_onetime_fig
+
+    def create_dumbell_chart(money_moved_top_n_donors_df):
+        # Top N Donor Chapter Dumbell Chart (Selected FY vs Prior FY)
+
+        money_moved_top_n_donors_df_pd = (money_moved_top_n_donors_df
+            .pivot(
+                values="payment_amount_usd",  # Replace with the column you want to aggregate
+                index=["pledge_donor_chapter"],  # Replace with the columns you want as index
+                on="payment_date_fy",
+                aggregate_function="sum"  # Replace with the aggregation function you need
+            )    
+            .rename({
+                selected_fy: "selected_fy",
+                prior_fy_value: "prior_fy"
+            })
+            .filter(pl.col("pledge_donor_chapter").is_not_null())
+            .with_columns([
+                pl.col("selected_fy").fill_null(0),
+                pl.col("prior_fy").fill_null(0),
+            ])
+            .with_columns([
+                (pl.col("selected_fy") + pl.col("prior_fy")).alias("total")
+            ])
+            .sort("total", descending=True)
+            .with_columns(pl.col(pl.Categorical).cast(pl.String))
+            .to_pandas()                         
+        )
+
+        if len(money_moved_top_n_donors_df_pd) > topn_donor_chapter_value:
+            top = money_moved_top_n_donors_df_pd.head(topn_donor_chapter_value)
+            other = money_moved_top_n_donors_df_pd.iloc[topn_donor_chapter_value:]
+            other_row = pd.DataFrame({
+                "pledge_donor_chapter": ["Other"],
+                "selected_fy": [other["selected_fy"].sum()],
+                "prior_fy": [other["prior_fy"].sum()],
+                "total": [other["total"].sum()]
+            })
+            top = pd.concat([top, other_row], ignore_index=True)
+        else:
+            top = money_moved_top_n_donors_df_pd
+
+        # Move "Unknown" to bottom after sorting
+        top_sorted = top.sort_values(by="total", ascending=False)
+        top_sorted["sort_key"] = top_sorted.apply(
+            lambda row: -1 if row["pledge_donor_chapter"] == "Unknown" or row["pledge_donor_chapter"] == "Other" else row["total"], axis=1
+        )
+        top_sorted = top_sorted.sort_values(by="sort_key", ascending=False).drop(columns="sort_key")
+
+        # Get the donor chapter ordering for the y-axis
+        donor_order = top_sorted["pledge_donor_chapter"].tolist()[::-1]    
+
+        dumbell_chart_fig = figure_instance.create_dumbell_chart_w_logo(top_sorted, selected_fy, prior_fy_value, donor_order)
+
+        return dumbell_chart_fig
+
+    results = (TaskGraph()
+        .add("kpi_cards", lambda: create_kpi_cards(query_results["ytd"]))
+        .add("monthly_graph", lambda: create_monthly_graph(query_results["ytd_monthly"], query_results["py_monthly"]))
+        .add("reoccuring_graph", lambda: create_reoccuring_graph(query_results["reoccuring"]))
+        .add("dumbell_chart", lambda: create_dumbell_chart(query_results["top_n_donors"]))
+        .run()
+    )
+
+    mm_card, cf_mm_card = results["kpi_cards"]
+    mm_monthly_fig = results["monthly_graph"]
+    reoccuring_vs_onetime_fig = results["reoccuring_graph"]
+    dumbell_chart_fig = results["dumbell_chart"]
 
     # Calendar heatmap
     # mm_heatmap_fig = figure_instance.create_calendarplot(money_moved_lf.collect())
@@ -298,11 +350,16 @@ def update_kpis_graphs(selected_fy, selected_amount_type, topn_donor_chapter_val
     Input("fy-filter", "value"),
     Input("mm-cf-radio-filter", "value"),
     Input("line-drilldown-by-filter", "value"),
+    Input("money-moved-line-graph", "relayoutData"),
     Input({"type": "ai-icon", "chart": ALL}, "n_clicks"),
     State("ai-message-store", "data"),
+    State("session-id", "data"),
+    State("money-moved-line-graph", "figure"),
     prevent_initial_call = "initial_duplicate"
 )
-def update_mm_monthly_trendline(selected_fy, selected_amount_type, selected_drilldown_by, ai_icon_clicks_list, existing_ai_messages):
+@cancellable(on_cancel = keep_current_output)
+@admit("interactive", on_timeout = keep_current_output)
+def update_mm_monthly_trendline(selected_fy, selected_amount_type, selected_drilldown_by, relayout_data, ai_icon_clicks_list, existing_ai_messages, session_id = None, current_figure = None):
     triggered_id = ctx.triggered_id
     chart_insight = None
 
@@ -311,23 +368,39 @@ def update_mm_monthly_trendline(selected_fy, selected_amount_type, selected_dril
     if triggered_id and isinstance(triggered_id, dict) and "type" in triggered_id:
         chart_insight = triggered_id.get("chart")
 
-    filters = []
+    # A zoom on the graph re-aggregates the visible range at the finest resolution that fits it;
+    # other relayouts (pan mode, hover mode, ...) leave the figure as it is. The relayoutData of an earlier
+    # view is kept by the graph, so any other trigger (a new FY, drilldown, ...) redraws the whole FY.
+    visible_range = None
+    if triggered_id == "money-moved-line-graph":
+        if selected_fy:
+            categories = money_moved_rollups.plotted_categories(current_figure)
+            visible_range = money_moved_rollups.visible_range(relayout_data, selected_fy, categories)
+        if visible_range is None and not (relayout_data or {}).get("xaxis.autorange"):
+            return dash.no_update, dash.no_update
+
+    if visible_range:
+        grain = money_moved_rollups.pick_grain(*visible_range)
+        rollup_df = money_moved_rollups.series(
+            selected_fy, grain, selected_amount_type, selected_drilldown_by,
+            exclude_portfolios = ["One for the World Discretionary Fund", "One for the World Operating Costs"],
+            start = visible_range[0], end = visible_range[1],
+        )
+        mm_monthly_trendline_fig = figure_instance.create_mm_trendline_rollup(rollup_df, grain, selected_drilldown_by, visible_range)
+    else:
+        filters = []
 
-    if selected_fy:
-        filters.append(("payment_date_fy", "==", selected_fy))
+        if selected_fy:
+            filters.append(("payment_date_fy", "==", selected_fy))
 
-    merged_lf = data_preparer.filter_data("merged", filters)
+        merged_lf = money_moved_cube.filter_data(filters, columns = money_moved_columns)
 
-    money_moved_lf = (merged_lf
-                        .select(["payment_date_fy", "payment_date_fm", "payment_date_calendar_year", "payment_date_calendar_month", "payment_date_calendar_monthname", 
-                            "payment_date_calendar_monthyear", "payment_date_day_of_week", "payment_date_week_of_fy", "pledge_status", "pledge_chapter_type", 
-                            "payment_portfolio", "payment_platform", "payment_date", "payment_amount_usd", "payment_cf_amount_usd"
-                        ])                   
-                        .filter(~pl.col("payment_portfolio").is_in(["One for the World Discretionary Fund", "One for the World Operating Costs"]))
-                    .sort("payment_date_fm")
-                    )
-    
-    mm_monthly_trendline_fig = figure_instance.create_mm_monthly_trendline(money_moved_lf, selected_amount_type, selected_drilldown_by)      
+        money_moved_lf = (merged_lf
+                            .filter(~pl.col("payment_portfolio").is_in(["One for the World Discretionary Fund", "One for the World Operating Costs"]))
+                        .sort("payment_date_fm")
+                        )
+
+        mm_monthly_trendline_fig = figure_instance.create_mm_monthly_trendline(money_moved_lf, selected_amount_type, selected_drilldown_by)
     
     # For AI insight
     ai_insight = []
@@ -350,9 +423,12 @@ def update_mm_monthly_trendline(selected_fy, selected_amount_type, selected_dril
     Input("target-form-data-store", "data"),
     Input({"type": "ai-icon", "chart": ALL}, "n_clicks"),
     State("ai-message-store", "data"),
+    State("session-id", "data"),
     prevent_initial_call = "initial_duplicate"
 )
-def update_active_pledge_arr_sankey(selected_fy, selected_view_mode, target_form_data, ai_icon_clicks_list, existing_ai_messages):
+@cancellable(on_cancel = keep_current_output)
+@admit("interactive", on_timeout = keep_current_output)
+def update_active_pledge_arr_sankey(selected_fy, selected_view_mode, target_form_data, ai_icon_clicks_list, existing_ai_messages, session_id = None):
     triggered_id = ctx.triggered_id
     chart_insight = None
 
@@ -371,7 +447,8 @@ def update_active_pledge_arr_sankey(selected_fy, selected_view_mode, target_form
     if selected_fy:
         filters.append(("pledge_starts_at_fy", "==", selected_fy))
 
-    pledge_active_arr_df = data_preparer.filter_data("pledge_active_arr", filters).collect()
+    pledge_active_arr_df = data_preparer.collect(data_preparer.filter_data("pledge_active_arr", filters),
+                                                 input_size = data_preparer.estimate_input_size("pledge_active_arr", filters))
 
 
     total_arr_value = pledge_active_arr_df.select(pl.sum("pledge_contribution_arr_usd")).item()
@@ -402,9 +479,12 @@ def update_active_pledge_arr_sankey(selected_fy, selected_view_mode, target_form
     Input("target-form-data-store", "data"),
     Input({"type": "ai-icon", "chart": ALL}, "n_clicks"),
     State("ai-message-store", "data"),
+    State("session-id", "data"),
     prevent_initial_call = "initial_duplicate"
 )
-def update_attrition_rate_line_graph(selected_fy, selected_drilldown_by, target_form_data, ai_icon_clicks_list, existing_ai_messages):
+@cancellable(on_cancel = keep_current_output)
+@admit("interactive", on_timeout = keep_current_output)
+def update_attrition_rate_line_graph(selected_fy, selected_drilldown_by, target_form_data, ai_icon_clicks_list, existing_ai_messages, session_id = None):
     triggered_id = ctx.triggered_id
     chart_insight = None
 
@@ -431,18 +511,17 @@ def update_attrition_rate_line_graph(selected_fy, selected_drilldown_by, target_
                         .filter(pl.col("pledge_starts_at_fm") < 9)  # No greater than Feb'25
                     )
 
-    attrition_rate_line_fig = figure_instance.create_attrition_rate_trendline(attrition_lf, selected_drilldown_by)
+    attrition_rate_line_fig = figure_instance.create_attrition_rate_trendline(attrition_lf, selected_drilldown_by,
+                                                                                input_size = data_preparer.estimate_input_size("pledge_attrition", filters))
 
     # Attrition rate kpi card
-    yearly_attrition_rate = (attrition_lf
+    yearly_attrition_rate = data_preparer.collect(attrition_lf
         .group_by(["pledge_starts_at_fy"])
         .agg([
             (pl.sum("total_pledge_count") / pl.sum("is_cancelled_count")).alias("attrition_rate"),
         ])
         .select("attrition_rate")
-        .collect()
-        .item()
-    )
+    ).item()
 
     # KPI card
     attrition_rate_card = figure_instance.create_kpi_card(yearly_attrition_rate, goal = ATTRITION_RATE_TARGET, body_text = "Pledge Attrition Rate", value_type = "%")
@@ -0,0 +1,17 @@
+import polars as pl
+from polars.testing import assert_frame_equal
+
+from utils.data_loader import data_loader, DATA_DIR
+
+
+def test_convert_merged_csv(tmp_path, monkeypatch):
+    # A CSV export of merged.parquet (ids are digit strings, so an inferred schema would read them as integers)
+    expected = pl.read_parquet(DATA_DIR / "merged.parquet").head(5000)
+    csv_path = tmp_path / "merged.csv"
+    expected.write_csv(csv_path)
+    monkeypatch.setattr(data_loader, "dir_name", str(tmp_path))
+
+    converted = pl.read_parquet(data_loader._convert_csv("merged", str(csv_path)))
+
+    assert converted.schema == expected.schema
+    assert_frame_equal(converted, expected)
@@ -0,0 +1,181 @@
+from collections import deque
+from concurrent.futures import CancelledError
+from contextlib import contextmanager
+from functools import wraps
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from utils.cancellation import current_token
+
+# Set OFTW_ADMISSION_SLOTS to the number of callbacks a worker runs at once (its gunicorn threads, usually)
+ADMISSION_SLOTS = int(os.getenv("OFTW_ADMISSION_SLOTS", "4"))
+
+# name -> (priority, concurrency limit, longest queue wait in seconds). Lower priorities are admitted first;
+# the limits keep heavy work and LLM insights from filling every slot an interactive refresh could use
+ADMISSION_CLASSES = {
+    "interactive": (0, ADMISSION_SLOTS, 30),
+    "heavy": (1, int(os.getenv("OFTW_ADMIT_HEAVY", "2")), 20),
+    "insight": (2, int(os.getenv("OFTW_ADMIT_INSIGHT", "1")), 10),
+}
+
+# Queue waits longer than this are logged
+SLOW_WAIT_SECONDS = 1.0
+
+# How often a queued request checks whether it was superseded (see utils.cancellation)
+CANCEL_CHECK_SECONDS = 0.05
+
+
+class AdmissionController:
+    """
+    Admits work into a worker by class: at most `slots` requests run at once, each class stays under
+    its own limit, and waiting requests are admitted by priority, then in arrival order. A waiting request
+    whose class is at its limit doesn't hold back requests of other classes.
+
+    Work admitted while the thread already holds a slot (e.g. an LLM insight inside a chart callback)
+    only counts against its class limit, so nesting never waits for the slot its caller holds.
+    """
+    def __init__(self, slots, classes):
+        self.slots = slots
+        self.classes = classes
+        self.running = {name: 0 for name in classes}
+        self.total_running = 0
+        self.queue = []     # heap of (priority, arrival, waiter)
+        self.metrics = {name: {"admitted": 0, "timed_out": 0, "superseded": 0, "wait_total": 0.0, "wait_max": 0.0, "waits": deque(maxlen = 1000)} for name in classes}
+        self._arrivals = itertools.count()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _dispatch(self):
+        """
+        Admits every waiter that fits, in priority order. Called with the lock held.
+        """
+        waiting = []
+        while self.queue:
+            entry = heapq.heappop(self.queue)
+            waiter = entry[2]
+            if waiter["cancelled"]:
+                continue
+            _, limit, _ = self.classes[waiter["class"]]
+            if self.running[waiter["class"]] < limit and (waiter["nested"] or self.total_running < self.slots):
+                self.running[waiter["class"]] += 1
+                if not waiter["nested"]:
+                    self.total_running += 1
+                waiter["admitted"] = True
+                waiter["event"].set()
+            else:
+                waiting.append(entry)
+        for entry in waiting:
+            heapq.heappush(self.queue, entry)
+
+    def acquire(self, admission_class):
+        """
+        Waits for a slot of the class. Raises TimeoutError after the class's longest queue wait, and
+        CancelledError as soon as the request's cancellation token is cancelled (see utils.cancellation).
+        """
+        if admission_class not in self.classes:
+            raise ValueError(f"Unknown admission class: {admission_class}")
+
+        priority, _, max_wait = self.classes[admission_class]
+        nested = getattr(self._local, "depth", 0) > 0
+        waiter = {"class": admission_class, "nested": nested, "event": threading.Event(), "admitted": False, "cancelled": False}
+        start = time.perf_counter()
+
+        with self._lock:
+            heapq.heappush(self.queue, (priority, next(self._arrivals), waiter))
+            self._dispatch()
+
+        # A request superseded while it queues leaves the queue instead of running for nothing
+        token = current_token()
+        while not waiter["event"].wait(max_wait if token is None else CANCEL_CHECK_SECONDS):
+            if token is None or token.cancelled or time.perf_counter() - start >= max_wait:
+                break
+        wait = time.perf_counter() - start
+
+        with self._lock:
+            metrics = self.metrics[admission_class]
+            if not waiter["admitted"]:
+                waiter["cancelled"] = True
+                if token is not None and token.cancelled:
+                    metrics["superseded"] += 1
+                    raise CancelledError(f"{admission_class} request superseded while queued")
+                metrics["timed_out"] += 1
+                raise TimeoutError(f"No {admission_class} slot free after {max_wait}s")
+            metrics["admitted"] += 1
+            metrics["wait_total"] += wait
+            metrics["wait_max"] = max(metrics["wait_max"], wait)
+            metrics["waits"].append(wait)
+
+        if wait > SLOW_WAIT_SECONDS:
+            print(f"Admission: {admission_class} request waited {wait:.2f}s for a slot.")
+        self._local.depth = getattr(self._local, "depth", 0) + 1
+        return nested
+
+    def release(self, admission_class, nested):
+        self._local.depth -= 1
+        with self._lock:
+            self.running[admission_class] -= 1
+            if not nested:
+                self.total_running -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, admission_class):
+        nested = self.acquire(admission_class)
+        try:
+            yield
+        finally:
+            self.release(admission_class, nested)
+
+    def stats(self):
+        """
+        Returns {class: {"running", "waiting", "admitted", "timed_out", "superseded", "wait_avg", "wait_p95", "wait_max"}}, with
+        queue waits in seconds (the 95th percentile over the last 1000 admissions).
+        """
+        with self._lock:
+            waiting = {name: 0 for name in self.classes}
+            for _, _, waiter in self.queue:
+                if not waiter["cancelled"]:
+                    waiting[waiter["class"]] += 1
+
+            stats = {}
+            for name, metrics in self.metrics.items():
+                waits = sorted(metrics["waits"])
+                stats[name] = {
+                    "running": self.running[name],
+                    "waiting": waiting[name],
+                    "admitted": metrics["admitted"],
+                    "timed_out": metrics["timed_out"],
+                    "superseded": metrics["superseded"],
+                    "wait_avg": metrics["wait_total"] / metrics["admitted"] if metrics["admitted"] else 0.0,
+                    "wait_p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+                    "wait_max": metrics["wait_max"],
+                }
+            return stats
+
+
+admission_controller = AdmissionController(ADMISSION_SLOTS, ADMISSION_CLASSES)
+
+
+def admit(admission_class, on_timeout = None):
+    """
+    Runs the decorated function in a slot of the admission class. When no slot frees up in time,
+    returns on_timeout(*args, **kwargs) instead (re-raises the TimeoutError without it).
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                nested = admission_controller.acquire(admission_class)
+            except TimeoutError:
+                if on_timeout is None:
+                    raise
+                return on_timeout(*args, **kwargs)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                admission_controller.release(admission_class, nested)
+        return wrapper
+    return decorator
@@ -0,0 +1,121 @@
+import polars as pl
+import numpy as np
+
+from utils.filter_compiler import filter_columns
+
+# Low-cardinality filter columns indexed per dataset (only the ones present are indexed)
+BITMAP_COLUMNS = {
+    "merged": ["payment_date_fy", "payment_platform", "pledge_chapter_type", "payment_portfolio", "pledge_status", "pledge_frequency", "pledge_frequency_type"],
+    "pledges": ["pledge_starts_at_fy", "pledge_payment_platform", "pledge_chapter_type", "pledge_status", "pledge_frequency"],
+}
+
+
+class BitmapIndex:
+    """
+    One packed bitset per value (and one for nulls) of a resident frame's low-cardinality string columns.
+
+    Filters on indexed columns resolve to a row selection by bitmap algebra. Each filter is resolved to a
+    (true rows, false rows) pair so null handling follows polars' three-valued logic exactly: a row whose
+    predicate is null is in neither set, and NOT swaps the two.
+    """
+    def __init__(self, df, columns):
+        self.rows = df.height
+        self.values = {}    # column -> {value: bitset}
+        self.nulls = {}     # column -> bitset of null rows
+        self.empty = np.zeros((self.rows + 7) // 8, dtype = np.uint8)
+
+        for col in columns:
+            if col not in df.columns or df.schema[col] not in [pl.String, pl.Categorical, pl.Enum]:
+                continue
+            groups = (df.select(pl.col(col).cast(pl.String).alias("value"))
+                .with_row_index("row")
+                .group_by("value")
+                .agg(pl.col("row"))
+            )
+            bitsets = {}
+            self.nulls[col] = self.empty
+            for value, rows in groups.iter_rows():
+                mask = np.zeros(self.rows, dtype = bool)
+                mask[rows] = True
+                if value is None:
+                    self.nulls[col] = np.packbits(mask)
+                else:
+                    bitsets[value] = np.packbits(mask)
+            self.values[col] = bitsets
+
+    @property
+    def columns(self):
+        return list(self.values)
+
+    def _leaf(self, col_name, op, value):
+        """
+        Returns (true, false) bitsets of a filter on an indexed column, or None when it can't be indexed.
+        """
+        if col_name not in self.values:
+            return None
+
+        bitsets, nulls = self.values[col_name], self.nulls[col_name]
+        valid = ~nulls
+        if op in ["null", "not_null"]:
+            true, false = nulls, valid
+            return (true, false) if op == "null" else (false, true)
+
+        values = value if op in ["in", "not_in"] else (value,)
+        if op not in ["==", "!=", "in", "not_in"] or not all(isinstance(v, str) for v in values):
+            return None
+
+        true = self.empty
+        for v in values:
+            true = true | bitsets.get(v, self.empty)
+        false = valid & ~true
+        return (true, false) if op in ["==", "in"] else (false, true)
+
+    def _resolve(self, canonical):
+        kind = canonical[0]
+        if kind == "filter":
+            return self._leaf(*canonical[1:])
+        if kind == "not":
+            child = self._resolve(canonical[1])
+            return None if child is None else (child[1], child[0])
+
+        children = [self._resolve(child) for child in canonical[1]]
+        if any(child is None for child in children):
+            return None
+        if kind == "and":
+            true, false = ~self.empty, self.empty
+            for child_true, child_false in children:
+                true, false = true & child_true, false | child_false
+        else:
+            true, false = self.empty, ~self.empty
+            for child_true, child_false in children:
+                true, false = true | child_true, false & child_false
+        return true, false
+
+    def select(self, canonical):
+        """
+        Resolves the indexed part of a canonical filter (see utils.filter_compiler). For an AND, every
+        indexed conjunct is resolved and the others are left over; any other filter is resolved whole or not at all.
+
+        Returns:
+        - tuple: (sorted row numbers as a UInt32 Series, or None when nothing was resolved, list of resolved columns, remaining canonical filter).
+        """
+        conjuncts = canonical[1] if canonical[0] == "and" else (canonical,)
+        selection = None
+        resolved_columns = []
+        remaining = []
+
+        for f in conjuncts:
+            resolved = self._resolve(f)
+            if resolved is None:
+                remaining.append(f)
+                continue
+            selection = resolved[0] if selection is None else selection & resolved[0]
+            resolved_columns.extend(col for col in filter_columns(f) if col not in resolved_columns)
+
+        if selection is None:
+            return None, [], canonical
+
+        rows = pl.Series(np.flatnonzero(np.unpackbits(selection, count = self.rows).view(bool)), dtype = pl.UInt32)
+        remaining = remaining[0] if len(remaining) == 1 else ("and", tuple(remaining))
+        return rows, resolved_columns, remaining
+
@@ -0,0 +1,272 @@
+"""
+Declares how the derived datasets (merged, pledge_active_arr, pledge_attrition) are built from
+payments and pledges, and rebuilds them as hive directories partitioned on their FY column.
+
+Each input row is mapped to the output FY partition it feeds and the rows are hashed per partition;
+a partition is only rebuilt when one of its input hashes changed since the last build.
+
+Usage:
+    python -m utils.build_pipeline [--datasets merged pledge_attrition] [--force]
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+
+import polars as pl
+
+from utils.compact_data import ROW_GROUP_SIZE, write_parquet
+from utils.data_loader import FY_COLUMNS, HIVE_NULL_PARTITION, SORT_COLUMNS, parquet_files, data_loader
+from utils.fiscal_calendar import fiscal_calendar
+
+MANIFEST_FILE = "_pipeline.json"
+
+PAYMENT_FAILURE_STATUSES = ["Payment failure", "ERROR"]    # Pledges left out of merged
+PERIODS_PER_YEAR = {"Monthly": 12, "Semi-Monthly": 24, "Quarterly": 4, "Annually": 1}   # Recurring frequencies
+
+MERGED_PLEDGE_COLUMNS = [
+    "pledge_donor_id", "pledge_id", "pledge_donor_chapter", "pledge_chapter_type", "pledge_status",
+    "pledge_created_at", "pledge_starts_at", "pledge_ended_at", "pledge_contribution_amount", "pledge_currency",
+    "pledge_frequency", "pledge_payment_platform", "pledge_contribution_amount_usd",
+]
+PAYMENT_DATE_COLUMNS = [
+    "calendar_year", "calendar_month", "calendar_monthname", "calendar_monthyear", "fy", "fm",
+    "week_of_month", "day_of_week", "week_of_year", "week_of_fy",
+]
+
+
+def build_merged(inputs):
+    """
+    Payments full-joined to their pledges, with the fiscal attributes of the payment date.
+    """
+    pledges = inputs["pledges"].filter(~pl.col("pledge_status").is_in(PAYMENT_FAILURE_STATUSES)).select(MERGED_PLEDGE_COLUMNS)
+    payment_dates = fiscal_calendar.date_dimension("payment_date").select(["payment_date"] + [f"payment_date_{col}" for col in PAYMENT_DATE_COLUMNS])
+
+    return (pledges
+        .join(inputs["payments"], left_on = "pledge_id", right_on = "payment_pledge_id", how = "full", coalesce = False)
+        .join(payment_dates.lazy(), on = "payment_date", how = "left")
+        .with_columns([
+            pl.col("pledge_payment_platform").fill_null(pl.col("payment_platform")),
+            pl.when(pl.col("pledge_frequency").is_in(list(PERIODS_PER_YEAR))).then(pl.lit("Recurring"))
+                .when(pl.col("pledge_frequency") == "One-Time").then(pl.lit("One-Time"))
+                .otherwise(pl.lit("Unspecified"))
+                .alias("pledge_frequency_type"),
+        ])
+    )
+
+
+def build_pledge_active_arr(inputs):
+    """
+    Count and annualized contribution (ARR) of active recurring pledges.
+    """
+    return (inputs["pledges"]
+        .filter(pl.col("pledge_status") == "Active donor", pl.col("pledge_frequency").is_in(list(PERIODS_PER_YEAR)))
+        .group_by([
+            "pledge_starts_at_fy", "pledge_frequency", "pledge_donor_chapter", "pledge_chapter_type", "pledge_payment_platform",
+        ])
+        .agg([
+            pl.col("pledge_contribution_amount_usd").sum(),
+            pl.len().alias("pledge_count"),
+            (pl.col("pledge_contribution_amount_usd") * pl.col("pledge_frequency").replace_strict(PERIODS_PER_YEAR, return_dtype = pl.Float64))
+                .sum().alias("pledge_contribution_arr_usd"),
+        ])
+    )
+
+
+def build_pledge_attrition(inputs):
+    """
+    Pledge and payment failure counts by start month.
+    """
+    return (inputs["pledges"]
+        .filter(pl.col("pledge_starts_at_fy").is_not_null())
+        .group_by([
+            "pledge_starts_at_fy", "pledge_starts_at_fm", "pledge_frequency", "pledge_chapter_type", "pledge_payment_platform",
+            "pledge_starts_at_calendar_month", "pledge_starts_at_calendar_monthyear",
+        ])
+        .agg([
+            pl.len().alias("total_pledge_count"),
+            (pl.col("pledge_status") == "Payment failure").sum().cast(pl.UInt32).alias("is_cancelled_count"),
+        ])
+        .select([
+            "pledge_starts_at_fy", "pledge_starts_at_fm", "pledge_frequency", "pledge_chapter_type", "pledge_payment_platform",
+            "total_pledge_count", "is_cancelled_count", "pledge_starts_at_calendar_month", "pledge_starts_at_calendar_monthyear",
+        ])
+    )
+
+
+def merged_partitions(inputs):
+    """
+    Payments feed the partition of their payment date; pledges feed the partitions of their payments,
+    or the null partition when they have none.
+    """
+    payment_fy = fiscal_calendar.date_dimension("payment_date").select(["payment_date", pl.col("payment_date_fy").alias("__fy")])
+    payments = inputs["payments"].join(payment_fy.lazy(), on = "payment_date", how = "left")
+    pledge_fys = payments.select([pl.col("payment_pledge_id").alias("pledge_id"), "__fy"]).unique()
+
+    return {
+        "payments": payments,
+        "pledges": inputs["pledges"].join(pledge_fys, on = "pledge_id", how = "left"),
+    }
+
+
+def pledge_start_partitions(inputs):
+    return {"pledges": inputs["pledges"].with_columns(pl.col("pledge_starts_at_fy").alias("__fy"))}
+
+
+# name -> (inputs, build, partitions). Inputs may themselves be derived datasets.
+PIPELINE = {
+    "merged": (["payments", "pledges"], build_merged, merged_partitions),
+    "pledge_active_arr": (["pledges"], build_pledge_active_arr, pledge_start_partitions),
+    "pledge_attrition": (["pledges"], build_pledge_attrition, pledge_start_partitions),
+}
+
+
+def build_order(datasets):
+    """
+    Returns the datasets to build, after the derived datasets they depend on.
+    """
+    order = []
+
+    def visit(name, path):
+        if name in path:
+            raise ValueError(f"Cycle in the build pipeline: {' -> '.join(path + [name])}")
+        if name in order or name not in PIPELINE:
+            return
+        for input_name in PIPELINE[name][0]:
+            visit(input_name, path + [name])
+        order.append(name)
+
+    for name in datasets:
+        visit(name, [])
+    return order
+
+
+def read_input(name):
+    """
+    Reads an input through the data loader (so delta files are included), with plain string columns.
+    """
+    return data_loader.get_data(name).with_columns(pl.col(pl.Categorical).cast(pl.String)).with_row_index("__row")
+
+
+def in_partitions(col, fys):
+    values = [fy for fy in fys if fy is not None]
+    expr = pl.col(col).is_in(values)
+    return expr | pl.col(col).is_null() if None in fys else expr
+
+
+def partition_hashes(lf):
+    """
+    Returns {fy: hash} over the rows mapped to each partition, independent of row order.
+    """
+    hashes = (lf
+        .select(["__fy", pl.struct(pl.exclude(["__fy", "__row"])).hash().alias("__hash")])
+        .group_by("__fy")
+        .agg(pl.col("__hash").sum())
+        .collect(engine = "streaming")
+    )
+    return {fy: str(h) for fy, h in hashes.iter_rows()}
+
+
+def partition_dir(target, fy_col, fy):
+    return os.path.join(target, f"{fy_col}={HIVE_NULL_PARTITION if fy is None else fy}")
+
+
+def build_dataset(name, data_dir, manifest_entry, force = False):
+    """
+    Rebuilds the changed FY partitions of a derived dataset. Returns its new manifest entry and the rebuilt partitions.
+    """
+    input_names, build_fn, partitions = PIPELINE[name]
+    fy_col = FY_COLUMNS[name]
+    target = os.path.join(data_dir, os.path.splitext(parquet_files[name])[0])
+
+    inputs = {input_name: read_input(input_name) for input_name in input_names}
+    mapped = partitions(inputs)
+    hashes = {input_name: partition_hashes(mapped[input_name]) for input_name in input_names}
+
+    # Hashes are only comparable within one polars version and for the files the last build wrote
+    old_hashes = manifest_entry.get("inputs", {})
+    full_rebuild = force or manifest_entry.get("polars") != pl.__version__ or not os.path.isdir(target)
+
+    def key(fy):
+        return HIVE_NULL_PARTITION if fy is None else fy
+
+    affected = set()
+    for input_name, new in hashes.items():
+        old = {None if fy == HIVE_NULL_PARTITION else fy: h for fy, h in old_hashes.get(input_name, {}).items()}
+        affected |= {fy for fy in new.keys() | old.keys() if full_rebuild or new.get(fy) != old.get(fy)}
+
+    if affected:
+        restricted = {
+            input_name: inputs[input_name]
+                .join(mapped[input_name].filter(in_partitions("__fy", affected)).select("__row").unique(), on = "__row", how = "semi")
+                .drop("__row")
+            for input_name in input_names
+        }
+        df = build_fn(restricted).filter(in_partitions(fy_col, affected)).collect(engine = "streaming")
+        if SORT_COLUMNS.get(name):
+            df = df.sort(SORT_COLUMNS[name], nulls_last = True, maintain_order = True)
+
+        if full_rebuild and os.path.isdir(target):
+            shutil.rmtree(target)
+
+        built = set()
+        for (fy,), part in df.group_by(fy_col, maintain_order = True):
+            path = partition_dir(target, fy_col, fy)
+            os.makedirs(path, exist_ok = True)
+            write_parquet(part.drop(fy_col), os.path.join(path, "part-0.parquet.tmp"), ROW_GROUP_SIZE)
+            for f in os.listdir(path):
+                if f != "part-0.parquet.tmp":
+                    os.remove(os.path.join(path, f))
+            os.replace(os.path.join(path, "part-0.parquet.tmp"), os.path.join(path, "part-0.parquet"))
+            built.add(fy)
+
+        # Partitions whose rows all went away
+        for fy in affected - built:
+            if os.path.isdir(partition_dir(target, fy_col, fy)):
+                shutil.rmtree(partition_dir(target, fy_col, fy))
+
+    entry = {
+        "polars": pl.__version__,
+        "inputs": {input_name: {key(fy): h for fy, h in new.items()} for input_name, new in hashes.items()},
+    }
+    return entry, sorted(affected, key = lambda fy: (fy is None, fy or ""))
+
+
+def build(datasets = None, force = False):
+    """
+    Rebuilds the derived datasets (all by default) and returns {name: rebuilt partitions}.
+    """
+    data_dir = data_loader.dir_name
+    manifest_path = os.path.join(data_dir, MANIFEST_FILE)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    rebuilt = {}
+    for name in build_order(datasets or list(PIPELINE)):
+        manifest[name], rebuilt[name] = build_dataset(name, data_dir, manifest.get(name, {}), force)
+        # Later steps read this dataset through the loader
+        data_loader.check_for_updates()
+
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent = 2)
+    return rebuilt
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Rebuild the derived datasets from payments and pledges.")
+    parser.add_argument("--datasets", nargs = "+", default = list(PIPELINE), choices = list(PIPELINE))
+    parser.add_argument("--force", action = "store_true", help = "Rebuild every partition.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rebuilt = build(args.datasets, args.force)
+    for name, fys in rebuilt.items():
+        print(f"{name:<20}{len(fys):>4} partitions rebuilt{': ' + ', '.join(str(fy) for fy in fys) if fys else ''}")
+    print(f"Done in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+from concurrent.futures import CancelledError
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+import inspect
+import os
+import threading
+import time
+
+# Set OFTW_QUERY_TIMEOUT to the seconds a callback's queries may run before they are cancelled (0 disables the deadline)
+QUERY_TIMEOUT = float(os.getenv("OFTW_QUERY_TIMEOUT", "60"))
+
+# How often a query running in the background is checked for its result and its token's state
+POLL_SECONDS = 0.002
+
+
+class CancellationToken:
+    """
+    Cancellation state of one callback invocation: cancelled when a newer invocation supersedes it, expired
+    once its deadline passes. Queries and tasks check it cooperatively, before and while they run.
+    """
+    def __init__(self, timeout = None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def expired(self):
+        return self.deadline is not None and time.monotonic() > self.deadline
+
+    def check(self):
+        """
+        Raises CancelledError once cancelled, TimeoutError once past the deadline.
+        """
+        if self.cancelled:
+            raise CancelledError("Superseded by a newer request")
+        if self.expired:
+            raise TimeoutError("Query deadline passed")
+
+    def wait(self, seconds):
+        """
+        Sleeps for up to `seconds`, waking as soon as the token is cancelled.
+        """
+        return self._cancelled.wait(seconds)
+
+
+# Token of the callback running in this thread; TaskGraph copies it into the pool threads running its tasks
+_current_token = ContextVar("cancellation_token", default = None)
+
+
+def current_token():
+    return _current_token.get()
+
+
+@contextmanager
+def use_token(token):
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
+
+
+def shielded():
+    """
+    Runs the block without the current token, for work whose result outlives the request
+    (e.g. the cube and rollup builds every session shares).
+    """
+    return use_token(None)
+
+
+def check_cancelled():
+    """
+    Raises if the current token is cancelled or expired; does nothing outside a cancellable callback.
+    """
+    token = current_token()
+    if token is not None:
+        token.check()
+
+
+def cancellable_collect(lf, **kwargs):
+    """
+    Collects a LazyFrame, honoring the current token: the query runs in the background and is
+    interrupted as soon as the token is cancelled or expires.
+
+    Polars only checks for the interrupt between the nodes of the plan, so the node running when the
+    token is cancelled still finishes; the calling thread waits for it (dropping the handle of an
+    unfinished query aborts the process) and then raises.
+    """
+    token = current_token()
+    if token is None:
+        return lf.collect(**kwargs)
+
+    token.check()
+    query = lf.collect(background = True, **kwargs)
+    while True:
+        df = query.fetch()
+        if df is not None:
+            return df
+        if token.cancelled or token.expired:
+            query.cancel()
+            try:
+                query.fetch_blocking()
+            except Exception:
+                pass    # "query interrupted"
+            token.check()
+        token.wait(POLL_SECONDS)
+
+
+_latest_tokens = {}     # (session id, callback) -> token of the latest invocation
+_tokens_lock = threading.Lock()
+
+
+def supersede(session_id, key, timeout = QUERY_TIMEOUT):
+    """
+    Returns a new token for an invocation of `key` by the session, cancelling the token of the
+    session's previous invocation, if it is still running. Without a session id the token only has a deadline.
+    """
+    token = CancellationToken(timeout)
+    if session_id is None:
+        return token
+
+    with _tokens_lock:
+        previous = _latest_tokens.get((session_id, key))
+        _latest_tokens[(session_id, key)] = token
+    if previous is not None:
+        previous.cancel()
+    return token
+
+
+def release(session_id, key, token):
+    with _tokens_lock:
+        if _latest_tokens.get((session_id, key)) is token:
+            del _latest_tokens[(session_id, key)]
+
+
+def cancellable(on_cancel = None, timeout = QUERY_TIMEOUT):
+    """
+    Runs the decorated callback with a cancellation token: a newer call of the callback with the same
+    `session_id` argument cancels it, and its queries are cancelled `timeout` seconds after it started.
+    When cancelled or past its deadline, returns on_cancel(*args, **kwargs) instead (re-raises without it).
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+        key = f"{fn.__module__}.{fn.__qualname__}"
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            session_id = signature.bind_partial(*args, **kwargs).arguments.get("session_id")
+            token = supersede(session_id, key, timeout)
+            try:
+                with use_token(token):
+                    return fn(*args, **kwargs)
+            except (CancelledError, TimeoutError):
+                if on_cancel is None or not (token.cancelled or token.expired):
+                    raise
+                if not token.cancelled:
+                    print(f"Cancellation: {key} passed its {timeout:g}s deadline.")
+                return on_cancel(*args, **kwargs)
+            finally:
+                release(session_id, key, token)
+        return wrapper
+    return decorator
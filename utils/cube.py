@@ -0,0 +1,156 @@
+import polars as pl
+
+import threading
+
+from utils.data_loader import data_loader
+from utils.cancellation import shielded
+from utils.data_preparer import DataPreparer
+from utils.filter_compiler import MATCH_ALL, compile_filter, filter_columns, normalize_filters
+from utils.sketches import HyperLogLog, sketch_by
+
+data_preparer = DataPreparer()
+
+# Dimensions and additive measures of the money moved cube. The calendar month columns are attributes of the fiscal month.
+CUBE_DIMENSIONS = [
+    "payment_date_fy", "payment_date_fm", "payment_date_calendar_month", "payment_date_calendar_monthyear",
+    "payment_platform", "pledge_chapter_type", "pledge_frequency_type", "payment_portfolio", "pledge_donor_chapter",
+]
+CUBE_MEASURES = ["payment_amount_usd", "payment_cf_amount_usd"]
+COUNT_MEASURE = "payment_count"
+
+# Dimensions of the distinct donor sketches of pledges
+DONOR_SKETCH_DIMENSIONS = [
+    "pledge_starts_at_fy", "pledge_starts_at_fm", "pledge_status", "pledge_chapter_type",
+    "pledge_payment_platform", "pledge_frequency", "pledge_donor_chapter",
+]
+
+# Smaller roll-ups kept next to the full cube; a query is answered from the smallest one holding its columns
+CUBOIDS = [
+    ["payment_date_fy", "pledge_donor_chapter"],
+    [dim for dim in CUBE_DIMENSIONS if dim != "pledge_donor_chapter"],
+]
+
+
+class MoneyMovedCube:
+    """
+    Money moved pre-aggregated over the chart dimensions, built once per data version of merged.
+
+    Slices keep the measure column names of merged (holding sums) plus payment_count, so chart code that
+    groups and sums payment_amount_usd / payment_cf_amount_usd gives the same result on a slice as on the raw rows.
+    """
+    def __init__(self, dataset_name = "merged"):
+        self.dataset_name = dataset_name
+        self.version = None
+        self.cuboids = {}   # frozenset of dimensions -> DataFrame
+        self._lock = threading.Lock()
+
+    def _build(self):
+        """
+        Aggregates the raw rows into the full cube, then rolls the full cube up into the smaller cuboids.
+        """
+        cube = data_preparer.collect(data_loader.get_data(self.dataset_name, columns = CUBE_DIMENSIONS + CUBE_MEASURES)
+                .group_by(CUBE_DIMENSIONS)
+                .agg([pl.col(measure).sum() for measure in CUBE_MEASURES] + [pl.len().alias(COUNT_MEASURE)]),
+            input_size = data_loader.estimate_size(self.dataset_name, columns = CUBE_DIMENSIONS + CUBE_MEASURES),
+        )
+
+        cuboids = {frozenset(CUBE_DIMENSIONS): cube}
+        for dimensions in CUBOIDS:
+            cuboids[frozenset(dimensions)] = (cube
+                .group_by(dimensions)
+                .agg([pl.col(measure).sum() for measure in CUBE_MEASURES + [COUNT_MEASURE]])
+            )
+        return cuboids
+
+    def get_cuboids(self):
+        version = data_loader.get_data_version(self.dataset_name)
+        with self._lock:
+            if self.version != version:
+                # Shared by every session, so a cancelled request doesn't abandon the build
+                with shielded():
+                    self.cuboids = self._build()
+                self.version = version
+            return self.cuboids
+
+    def filter_data(self, filters = None, columns = None, logic = "AND"):
+        """
+        Slices the cube like DataPreparer.filter_data slices merged.
+
+        Parameters:
+        - filters (list): filter_data filters on cube dimensions.
+        - columns (list of str): Dimensions to return, with the measures. Defaults to every dimension.
+        - logic (str): "AND" (default) or "OR" for combining filters.
+
+        Returns:
+        - LazyFrame: The matching cells of the smallest cuboid holding the requested and filtered dimensions.
+        """
+        canonical = normalize_filters(filters, logic)
+        dimensions = [col for col in (columns or CUBE_DIMENSIONS) if col not in CUBE_MEASURES + [COUNT_MEASURE]]
+        needed = set(dimensions) | set(filter_columns(canonical) if canonical != MATCH_ALL else [])
+
+        unknown = needed - set(CUBE_DIMENSIONS)
+        if unknown:
+            raise ValueError(f"Not cube dimensions: {', '.join(sorted(unknown))}")
+
+        cuboids = self.get_cuboids()
+        cuboid = min((df for dims, df in cuboids.items() if needed <= dims), key = lambda df: df.height)
+
+        lf = cuboid.lazy()
+        if canonical != MATCH_ALL:
+            lf = lf.filter(compile_filter(canonical))
+        return lf.select(dimensions + CUBE_MEASURES + [COUNT_MEASURE])
+
+
+
+class DistinctCountCube:
+    """
+    One mergeable HyperLogLog sketch of a column's distinct values per cell of the given dimensions,
+    built once per data version. A distinct count under any filter on the dimensions merges the sketches
+    of the matching cells instead of scanning the rows; it is exact up to EXACT_THRESHOLD distinct values.
+    """
+    def __init__(self, dataset_name, dimensions, column):
+        self.dataset_name = dataset_name
+        self.dimensions = dimensions
+        self.column = column
+        self.version = None
+        self.cells = None       # DataFrame of the cells' dimension values
+        self.sketches = []      # HyperLogLog per row of self.cells
+        self._lock = threading.Lock()
+
+    def get_sketches(self):
+        version = data_loader.get_data_version(self.dataset_name)
+        with self._lock:
+            if self.version != version:
+                columns = self.dimensions + [self.column]
+                engine = data_preparer.get_engine(data_loader.estimate_size(self.dataset_name, columns = columns))
+                cells, self.sketches = sketch_by(data_loader.get_data(self.dataset_name, columns = columns), self.dimensions, self.column, engine)
+                self.cells = cells.with_columns(pl.col(pl.Categorical).cast(pl.String)).with_row_index("__cell")
+                self.version = version
+            return self.cells, self.sketches
+
+    def count_distinct(self, filters = None, logic = "AND"):
+        """
+        Counts the distinct values of the column over the rows matching filters on the dimensions.
+
+        Parameters:
+        - filters (list): filter_data filters on the cube dimensions.
+        - logic (str): "AND" (default) or "OR" for combining filters.
+
+        Returns:
+        - int: The distinct count, exact for small cardinalities and estimated above.
+        """
+        canonical = normalize_filters(filters, logic)
+        if canonical != MATCH_ALL:
+            unknown = set(filter_columns(canonical)) - set(self.dimensions)
+            if unknown:
+                raise ValueError(f"Not cube dimensions: {', '.join(sorted(unknown))}")
+
+        cells, sketches = self.get_sketches()
+        if canonical != MATCH_ALL:
+            cells = cells.filter(compile_filter(canonical))
+        return HyperLogLog.merge(sketches[i] for i in cells.get_column("__cell").to_list()).count()
+
+
+money_moved_cube = MoneyMovedCube()
+pledge_donor_cube = DistinctCountCube("pledges", DONOR_SKETCH_DIMENSIONS, "pledge_donor_id")
+
@@ -1,53 +1,1137 @@
 import polars as pl
+import pyarrow.parquet as pq
 
 from pathlib import Path
 import os
 import threading
+import hashlib
+import json
+import time
+import fcntl
+from contextlib import contextmanager
+from urllib.parse import unquote
+
+from utils.fiscal_calendar import fiscal_calendar
+from utils.bitmap_index import BitmapIndex, BITMAP_COLUMNS
 
 DATA_DIR = (Path(__file__)/'..'/'..'/'data').resolve()
 
+# New rows can be appended as parquet files under data/deltas/<dataset>/ instead of rewriting the dataset.
+# Set OFTW_DELTA_COMPACT_INTERVAL to a number of seconds to periodically fold them into the base files.
+DELTA_DIR = "deltas"
+DELTA_COMPACT_INTERVAL = float(os.getenv("OFTW_DELTA_COMPACT_INTERVAL", "0"))
+
+# Counter in each delta directory, bumped whenever rows are appended or folded into the base files.
+# Every worker compares it with the generation it loaded and reloads the base files and deltas together when it moved.
+GENERATION_FILE = ".generation"
+
+# CSV sources (e.g. payments.csv in place of payments.parquet) are converted once to parquet in this cache,
+# keyed by the hash of the CSV, with the declared column types below (the layout of the parquet sources).
+# Undeclared columns, and every column of an undeclared dataset, are read as strings rather than inferred.
+CSV_CACHE_DIR = ".csv_cache"
+CSV_SCHEMAS = {
+    "payments": {
+        "payment_id": pl.String, "payment_donor_id": pl.String, "payment_pledge_id": pl.String,
+        "payment_platform": pl.String, "payment_portfolio": pl.String, "payment_amount": pl.Float64,
+        "payment_currency": pl.String, "payment_date": pl.Date, "payment_counterfactuality": pl.Float64,
+        "payment_amount_usd": pl.Float64, "payment_cf_amount_usd": pl.Float64,
+    },
+    "pledges": {
+        "pledge_donor_id": pl.String, "pledge_id": pl.String, "pledge_donor_chapter": pl.String,
+        "pledge_chapter_type": pl.String, "pledge_status": pl.String, "pledge_created_at": pl.Date,
+        "pledge_starts_at": pl.Date, "pledge_ended_at": pl.Date, "pledge_contribution_amount": pl.Float64,
+        "pledge_currency": pl.String, "pledge_frequency": pl.String, "pledge_payment_platform": pl.String,
+        "pledge_contribution_amount_usd": pl.Float64, "pledge_starts_at_calendar_year": pl.Int32,
+        "pledge_starts_at_calendar_month": pl.Int8, "pledge_starts_at_calendar_monthname": pl.String,
+        "pledge_starts_at_calendar_monthyear": pl.String, "pledge_starts_at_fy": pl.String,
+        "pledge_starts_at_fm": pl.Int8, "pledge_starts_at_week_of_month": pl.Int8, "pledge_starts_at_day_of_week": pl.Int8,
+        "pledge_starts_at_week_of_year": pl.Int32, "pledge_starts_at_week_of_fy": pl.Int64,
+    },
+    "merged": {
+        "pledge_donor_id": pl.String, "pledge_id": pl.String, "pledge_donor_chapter": pl.String,
+        "pledge_chapter_type": pl.String, "pledge_status": pl.String, "pledge_created_at": pl.Date,
+        "pledge_starts_at": pl.Date, "pledge_ended_at": pl.Date, "pledge_contribution_amount": pl.Float64,
+        "pledge_currency": pl.String, "pledge_frequency": pl.String, "pledge_payment_platform": pl.String,
+        "pledge_contribution_amount_usd": pl.Float64, "payment_id": pl.String, "payment_donor_id": pl.String,
+        "payment_pledge_id": pl.String, "payment_platform": pl.String, "payment_portfolio": pl.String,
+        "payment_amount": pl.Float64, "payment_currency": pl.String, "payment_date": pl.Date,
+        "payment_counterfactuality": pl.Float64, "payment_amount_usd": pl.Float64, "payment_cf_amount_usd": pl.Float64,
+        "payment_date_calendar_year": pl.Int32, "payment_date_calendar_month": pl.Int8,
+        "payment_date_calendar_monthname": pl.String, "payment_date_calendar_monthyear": pl.String,
+        "payment_date_fy": pl.String, "payment_date_fm": pl.Int8, "payment_date_week_of_month": pl.Int8,
+        "payment_date_day_of_week": pl.Int8, "payment_date_week_of_year": pl.Int32, "payment_date_week_of_fy": pl.Int64,
+        "pledge_frequency_type": pl.String,
+    },
+    "pledge_active_arr": {
+        "pledge_starts_at_fy": pl.String, "pledge_frequency": pl.String, "pledge_donor_chapter": pl.String,
+        "pledge_chapter_type": pl.String, "pledge_payment_platform": pl.String, "pledge_contribution_amount_usd": pl.Float64,
+        "pledge_count": pl.UInt32, "pledge_contribution_arr_usd": pl.Float64,
+    },
+    "pledge_attrition": {
+        "pledge_starts_at_fy": pl.String, "pledge_starts_at_fm": pl.Int8, "pledge_frequency": pl.String,
+        "pledge_chapter_type": pl.String, "pledge_payment_platform": pl.String, "total_pledge_count": pl.UInt32,
+        "is_cancelled_count": pl.UInt32, "pledge_starts_at_calendar_month": pl.Int8,
+        "pledge_starts_at_calendar_monthyear": pl.String,
+    },
+}
+
+# Set OFTW_MATERIALIZE=1 to decode every dataset once into memory instead of re-scanning the files on each query
+MATERIALIZE = os.getenv("OFTW_MATERIALIZE", "0") == "1"
+
+# Set OFTW_WATCH_INTERVAL to a number of seconds to poll the data files and hot reload them when they change
+WATCH_INTERVAL = float(os.getenv("OFTW_WATCH_INTERVAL", "0"))
+
+# Set OFTW_SHARED_SNAPSHOT=1 to materialize through uncompressed Arrow IPC snapshots that every worker
+# memory-maps, so all gunicorn workers share one copy of the data through the OS page cache
+SHARED_SNAPSHOT = os.getenv("OFTW_SHARED_SNAPSHOT", "0") == "1"
+SNAPSHOT_DIR = ".snapshots"
+
+# Set OFTW_STAR_SCHEMA=1 to hold merged as a slim payment fact table plus pledge and fiscal date dimensions
+# (implies OFTW_MATERIALIZE). Queries on merged then only join the dimensions whose columns they reference.
+STAR_SCHEMA = os.getenv("OFTW_STAR_SCHEMA", "0") == "1"
+
+# Star schema split per dataset: fact table name and {dimension name: (key column, dimension column prefix)}
+STAR_SCHEMAS = {
+    "merged": {
+        "facts": "payment_facts",
+        "dimensions": {
+            "pledge_dim": ("pledge_key", "pledge_"),
+            "date_dim": ("payment_date", "payment_date_"),
+        },
+    },
+}
+
+# Set OFTW_OPTIMIZE_DTYPES=0 to keep the file dtypes of materialized datasets
+OPTIMIZE_DTYPES = os.getenv("OFTW_OPTIMIZE_DTYPES", "1") == "1"
+
+# Low-cardinality string columns (by name suffix) stored as Categorical in materialized datasets
+CATEGORICAL_SUFFIXES = (
+    "_fy", "_status", "_chapter_type", "_donor_chapter", "_platform", "_portfolio", "_frequency", "_frequency_type",
+    "_currency", "_calendar_monthname", "_calendar_monthyear",
+)
+# Other string columns are inferred as Categorical when at most this share of their values is distinct
+CATEGORICAL_MAX_DISTINCT_RATIO = 0.05
+
+# Smallest integer types tried when downcasting, per signedness
+SIGNED_INTS = [pl.Int8, pl.Int16, pl.Int32, pl.Int64]
+UNSIGNED_INTS = [pl.UInt8, pl.UInt16, pl.UInt32, pl.UInt64]
+
+# Categoricals from different datasets and reloads must compare and join through one global string cache,
+# and sort by their string values. Both are built in from polars 1.32 on.
+if tuple(int(part) for part in pl.__version__.split(".")[:2]) >= (1, 32):
+    CATEGORICAL = pl.Categorical
+else:
+    pl.enable_string_cache()
+    CATEGORICAL = pl.Categorical("lexical")
+
+# Fiscal year column each dataset is indexed on
+FY_COLUMNS = {
+    "merged": "payment_date_fy",
+    "pledges": "pledge_starts_at_fy",
+    "pledge_active_arr": "pledge_starts_at_fy",
+    "pledge_attrition": "pledge_starts_at_fy",
+}
+
+# Partition directory name polars uses for null partition values
+HIVE_NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+# Sort order written by `python -m utils.compact_data`, recorded per dataset in LAYOUT_FILE
+SORT_COLUMNS = {
+    "merged": ["payment_date_fy", "payment_date_fm"],
+    "payments": ["payment_date"],
+    "pledges": ["pledge_starts_at_fy", "pledge_starts_at_fm"],
+    "pledge_active_arr": ["pledge_starts_at_fy"],
+    "pledge_attrition": ["pledge_starts_at_fy", "pledge_starts_at_fm"],
+}
+LAYOUT_FILE = "_layout.json"
+
+def data_files(path):
+    """
+    Returns the data files behind a path: the file itself, or every parquet file of a partitioned directory.
+    """
+    if os.path.isdir(path):
+        return sorted(str(p) for p in Path(path).rglob("*.parquet"))
+    return [path]
+
+_file_hashes = {}   # (file, mtime_ns, size) -> digest, so unchanged files are never re-read
+
+def file_hash(file):
+    """
+    Hashes the content of a single file.
+    """
+    stat = os.stat(file)
+    key = (file, stat.st_mtime_ns, stat.st_size)
+    if key not in _file_hashes:
+        digest = hashlib.blake2b(digest_size = 16)
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        _file_hashes[key] = digest.hexdigest()
+    return _file_hashes[key]
+
+def content_hash(path):
+    """
+    Hashes the content of a data file or partitioned directory.
+    """
+    digest = hashlib.blake2b(digest_size = 16)
+    for file in data_files(path):
+        digest.update(os.path.relpath(file, path).encode())
+        digest.update(file_hash(file).encode())
+    return digest.hexdigest()
+
+def parquet_footer_stats(files):
+    """
+    Row count and {column: {"null_count", "min", "max"}} read from the parquet footers, for the
+    non-string columns whose every row group carries statistics.
+    """
+    rows = 0
+    columns = {}
+    incomplete = set()
+    for file in files:
+        metadata = pq.read_metadata(file)
+        rows += metadata.num_rows
+        for i in range(metadata.num_row_groups):
+            row_group = metadata.row_group(i)
+            for j in range(row_group.num_columns):
+                chunk = row_group.column(j)
+                name, stats = chunk.path_in_schema, chunk.statistics
+                # String bounds may be truncated by the writer, so those are always computed
+                if stats is None or not stats.has_null_count or chunk.physical_type == "BYTE_ARRAY":
+                    incomplete.add(name)
+                    continue
+                col = columns.setdefault(name, {"null_count": 0, "min": None, "max": None})
+                col["null_count"] += stats.null_count
+                if stats.has_min_max:
+                    col["min"] = stats.min if col["min"] is None else min(col["min"], stats.min)
+                    col["max"] = stats.max if col["max"] is None else max(col["max"], stats.max)
+                elif stats.null_count < chunk.num_values:
+                    incomplete.add(name)
+    return rows, {name: col for name, col in columns.items() if name not in incomplete}
+
+_column_sizes = {}  # (file, mtime_ns, size) -> {column: uncompressed bytes}
+
+def parquet_column_sizes(files):
+    """
+    Uncompressed size of each column summed over the files, read from the parquet footers.
+    """
+    sizes = {}
+    for file in files:
+        stat = os.stat(file)
+        key = (file, stat.st_mtime_ns, stat.st_size)
+        if key not in _column_sizes:
+            metadata = pq.read_metadata(file)
+            file_sizes = {}
+            for i in range(metadata.num_row_groups):
+                row_group = metadata.row_group(i)
+                for j in range(row_group.num_columns):
+                    chunk = row_group.column(j)
+                    file_sizes[chunk.path_in_schema] = file_sizes.get(chunk.path_in_schema, 0) + chunk.total_uncompressed_size
+            _column_sizes[key] = file_sizes
+        for col, size in _column_sizes[key].items():
+            sizes[col] = sizes.get(col, 0) + size
+    return sizes
+
+def prune_file_caches():
+    """
+    Drops the cached hashes and column sizes of files that were removed or rewritten since they were cached,
+    so the caches only hold entries for the current data files.
+    """
+    for cache in (_file_hashes, _column_sizes):
+        for key in list(cache):
+            file, mtime_ns, size = key
+            try:
+                stat = os.stat(file)
+                current = (stat.st_mtime_ns, stat.st_size) == (mtime_ns, size)
+            except OSError:
+                current = False
+            if not current:
+                cache.pop(key, None)
+
+def read_layout(dir_name):
+    """
+    Reads the layout file: {dataset: {"content_hash", "sorted_columns", "sorted_within_fy"}}.
+    """
+    layout_path = os.path.join(dir_name, LAYOUT_FILE)
+    if not os.path.exists(layout_path):
+        return {}
+    with open(layout_path, "r") as f:
+        return json.load(f)
+
+class ReadWriteLock:
+    """
+    Many concurrent readers or one writer. Waiting writers block new readers, so a swap is never starved.
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+
+    def release_write(self):
+        with self._cond:
+            self._writing = False
+            self._cond.notify_all()
+
+
+class ColumnStats(dict):
+    """
+    Statistics of one column. The distinct "values" (and "n_unique") are only computed when first read.
+    """
+    def __init__(self, stats, compute_values):
+        super().__init__(stats)
+        self._compute_values = compute_values
+
+    def __missing__(self, key):
+        if key not in ["values", "n_unique"]:
+            raise KeyError(key)
+        self.update(self._compute_values())
+        return self[key]
+
+
+class StarView:
+    """
+    A dataset held as a fact table plus dimension tables, rebuilt by joins when queried.
+    """
+    def __init__(self, facts, dimensions, columns, fy_col):
+        self.facts = facts              # Fact table dataset name
+        self.dimensions = dimensions    # {dimension dataset name: (key column, dimension columns)}
+        self.columns = columns          # Column order of the original dataset
+        self.fy_col = fy_col
+
+
 class DataLoader:
     _instance = None
     _lock = threading.Lock()    # Thread-safe singleton lock
 
-    def __new__(cls, file_names):
+    def __new__(cls, *args, **kwargs):
         if not cls._instance:
             with cls._lock:
                 if not cls._instance:
                     cls._instance = super().__new__(cls)
         return cls._instance
 
-    def __init__(self, file_names):
+    def __init__(self, file_names, materialize = MATERIALIZE, watch_interval = WATCH_INTERVAL, optimize_dtypes = OPTIMIZE_DTYPES,
+                 shared_snapshot = SHARED_SNAPSHOT, star_schema = STAR_SCHEMA, delta_compact_interval = DELTA_COMPACT_INTERVAL):
         if not hasattr(self, 'dir_name'):  # Ensure attributes are initialized only once
             self.dir_name = DATA_DIR
+            self.materialize = materialize or shared_snapshot or star_schema
+            self.optimize_dtypes = optimize_dtypes
+            self.shared_snapshot = shared_snapshot
+            self.star_schema = star_schema
+            self.file_names = dict(file_names or {})
             self.dataframes = {}
+            self.fy_index = {}
+            self.partitions = {}
+            self.sort_orders = {}
+            self.deltas = {}
             self.schema = {}
+            self.file_signatures = {}
+            self.dataset_versions = {}
+            self.data_version = 0
+            self._rw_lock = ReadWriteLock()
+            self._watcher = None
+            self._stats = {}    # dataset -> (data version, rows, {column: stats})
+            self._stats_lock = threading.Lock()
+            self._bitmap_indexes = {}   # dataset -> (data version, BitmapIndex)
+            self._bitmap_lock = threading.Lock()
+            self._delta_compactor = None
+            self._reload_lock = threading.Lock()
             if file_names:
                 self._load_all(file_names)
+            if watch_interval > 0:
+                self.start_watcher(watch_interval)
+            if delta_compact_interval > 0:
+                self.start_delta_compactor(delta_compact_interval)
 
     def _load_all(self, file_names):
         """
-        Load multiple files (CSV and Parquet) into lazy Polars DataFrames.
+        Load multiple files (CSV and Parquet) into lazy Polars DataFrames,
+        or into resident DataFrames when materialized mode is on.
+        """
+        signatures = {}
+        for name in file_names:
+            with self._dataset_lock(name):
+                signatures[name] = self._dataset_signature(name)
+        self._swap(self._build_datasets(signatures), signatures)
+
+    def _full_path(self, dataset_name):
+        """
+        Resolves the dataset's path. A hive-partitioned directory next to the file
+        (e.g. data/merged/ for merged.parquet) takes precedence over the single file,
+        and a CSV export with the same name is used when the file is missing.
+        """
+        path = os.path.join(self.dir_name, self.file_names[dataset_name])
+        partitioned_dir = os.path.splitext(path)[0]
+        if os.path.isdir(partitioned_dir):
+            return partitioned_dir
+        if not os.path.exists(path) and os.path.exists(f"{partitioned_dir}.csv"):
+            return f"{partitioned_dir}.csv"
+        return path
+
+    def _build_datasets(self, signatures):
+        """
+        Builds {name: (data, fy_index, partitions, sort_order, deltas)} for the given datasets without touching the live ones.
+        """
+        layout = read_layout(self.dir_name)
+        datasets = {}
+        for name, signature in signatures.items():
+            with self._dataset_lock(name):
+                path = self._full_path(name)
+                lf = self._load_file(path, name)
+
+                # Delta files are read eagerly, so a compaction deleting them never breaks a running query
+                deltas = self._read_deltas(name)
+                if deltas is not None:
+                    lf = pl.concat([lf, deltas.lazy()], how = "diagonal_relaxed")
+
+                # The recorded sort order only holds for the exact files the compaction wrote (without deltas)
+                sort_order = layout.get(name, {})
+                if sort_order.get("content_hash") != signature[2]:
+                    sort_order = {}
+
+                if self.shared_snapshot:
+                    data, fy_index = self._load_snapshot(name, lf, sort_order, signature)
+                elif self.materialize:
+                    data, fy_index = self._materialize(name, lf, sort_order)
+                else:
+                    data, fy_index = lf, {}
+
+            if isinstance(data, pl.DataFrame):
+                deltas = None   # Already part of the resident frame
+
+            if self.star_schema and name in STAR_SCHEMAS:
+                datasets.update(self._split_star(name, data, fy_index))
+                data = datasets.pop(name)[0]
+            datasets[name] = (data, fy_index, self._list_partitions(name, path), sort_order, deltas)
+        return datasets
+
+    def _split_star(self, dataset_name, df, fy_index):
+        """
+        Splits a resident dataset into its fact table and dimension tables. Each distinct combination of
+        dimension columns gets a surrogate key unless the dimension has a natural key. Date keys take their
+        attributes from the fiscal calendar, which adds integer keys such as payment_date_fy_key.
+        The fact table keeps the row order, so the FY row-range index still applies to it.
+        Returns datasets in the _build_datasets format, with the StarView under `dataset_name`.
+        """
+        star = STAR_SCHEMAS[dataset_name]
+        datasets = {}
+        dimensions = {}
+        facts = df
+
+        for dim_name, (key, prefix) in star["dimensions"].items():
+            dim_cols = [col for col in df.columns if col.startswith(prefix)]
+
+            if key in df.columns and df.schema[key] == pl.Date:
+                dim = (df
+                    .select(key)
+                    .filter(pl.col(key).is_not_null())
+                    .unique(maintain_order = True)
+                    .join(fiscal_calendar.date_dimension(key), on = key, how = "left")
+                    .cast({col: df.schema[col] for col in dim_cols})
+                )
+            elif key in df.columns:
+                dim = df.select([key] + dim_cols).filter(pl.col(key).is_not_null()).unique(subset = key, maintain_order = True)
+            else:
+                # group_by treats nulls as equal, so every row lands in exactly one group
+                groups = (df
+                    .select(dim_cols)
+                    .with_row_index("__row")
+                    .group_by(dim_cols, maintain_order = True)
+                    .agg(pl.col("__row"))
+                    .with_row_index(key)
+                )
+                dim = groups.drop("__row")
+                row_keys = groups.select([key, "__row"]).explode("__row").sort("__row").get_column(key)
+                facts = facts.with_columns(row_keys)
+
+            facts = facts.drop(dim_cols)
+            dimensions[dim_name] = (key, [col for col in dim.columns if col != key])
+            datasets[dim_name] = (dim, {}, {}, {}, None)
+
+        datasets[star["facts"]] = (facts, fy_index, {}, {}, None)
+        datasets[dataset_name] = (StarView(star["facts"], dimensions, df.columns, FY_COLUMNS.get(dataset_name)), fy_index, {}, {}, None)
+        return datasets
+
+    def _swap(self, datasets, signatures):
+        """
+        Atomically publishes newly built datasets and bumps the data version.
+        """
+        self._rw_lock.acquire_write()
+        try:
+            dataframes = dict(self.dataframes)
+            fy_index = dict(self.fy_index)
+            partitions = dict(self.partitions)
+            sort_orders = dict(self.sort_orders)
+            deltas = dict(self.deltas)
+            for name, (data, index, files, sort_order, delta_df) in datasets.items():
+                dataframes[name] = data
+                fy_index[name] = index
+                partitions[name] = files
+                sort_orders[name] = sort_order
+                deltas[name] = delta_df
+                self.dataset_versions[name] = self.data_version + 1
+
+            self.dataframes, self.fy_index, self.partitions, self.sort_orders, self.deltas = dataframes, fy_index, partitions, sort_orders, deltas
+            self.file_signatures.update(signatures)
+            self.data_version += 1
+        finally:
+            self._rw_lock.release_write()
+        prune_file_caches()
+
+    def _dataset_stat(self, dataset_name):
+        """
+        Returns (latest mtime_ns, total size) over the dataset's file(s) and delta files.
+        """
+        stats = [os.stat(f) for f in data_files(self._full_path(dataset_name)) + self._delta_files(dataset_name)]
+        return (max((s.st_mtime_ns for s in stats), default = 0), sum(s.st_size for s in stats))
+
+    def _dataset_signature(self, dataset_name):
+        """
+        Returns (mtime_ns, size, content hash, delta generation) over the dataset's file(s) and delta files.
+        Without deltas the hash is the content hash of the base, as recorded by the compaction.
+        """
+        digest = content_hash(self._full_path(dataset_name))
+        delta_files = self._delta_files(dataset_name)
+        if delta_files:
+            digest = hashlib.blake2b("".join([digest] + [file_hash(f) for f in delta_files]).encode(), digest_size = 16).hexdigest()
+        return self._dataset_stat(dataset_name) + (digest, self._read_generation(dataset_name))
+
+    def check_for_updates(self):
+        """
+        Reloads the datasets whose files changed since they were loaded. Files are only hashed when
+        their mtime or size moved, and a new version is only published when the content hash differs.
+        Returns the names of the reloaded datasets.
+        """
+        changed = {}
+        for name in self.file_names:
+            old_signature = self.file_signatures.get(name)
+            try:
+                with self._dataset_lock(name):
+                    stat = self._dataset_stat(name)
+                    if old_signature and old_signature[:2] == stat:
+                        continue
+                    signature = self._dataset_signature(name)
+            except FileNotFoundError:
+                continue    # Mid-replacement, try again on the next poll
+
+            if old_signature and signature[2] == old_signature[2]:
+                self.file_signatures[name] = signature  # Touched but identical content
+                continue
+            changed[name] = signature
+
+        if changed:
+            self._swap(self._build_datasets(changed), changed)
+
+        return list(changed)
+
+    def start_watcher(self, interval):
+        """
+        Starts a daemon thread that polls the data files every `interval` seconds.
+        """
+        if self._watcher is not None:
+            return
+
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.check_for_updates()
+                except Exception as e:
+                    # Keep serving the current version, e.g. while an export is still being written
+                    print(f"Error reloading data files: {e}")
+
+        self._watcher = threading.Thread(target = watch, name = "data-file-watcher", daemon = True)
+        self._watcher.start()
+
+    def _delta_dir(self, dataset_name):
+        return os.path.join(self.dir_name, DELTA_DIR, dataset_name)
+
+    def _delta_files(self, dataset_name):
+        delta_dir = self._delta_dir(dataset_name)
+        if not os.path.isdir(delta_dir):
+            return []
+        return sorted(str(p) for p in Path(delta_dir).glob("*.parquet"))
+
+    def _read_deltas(self, dataset_name):
+        """
+        Reads the dataset's delta files into one frame, or returns None when there are none.
+        """
+        delta_files = self._delta_files(dataset_name)
+        if not delta_files:
+            return None
+        return pl.concat([pl.read_parquet(f) for f in delta_files], how = "diagonal_relaxed")
+
+    def _read_generation(self, dataset_name):
+        try:
+            with open(os.path.join(self._delta_dir(dataset_name), GENERATION_FILE), "r") as f:
+                return int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _bump_generation(self, dataset_name):
+        """
+        Increments the dataset's delta generation. Called with the dataset lock held exclusively.
+        """
+        path = os.path.join(self._delta_dir(dataset_name), GENERATION_FILE)
+        with open(f"{path}.{os.getpid()}.tmp", "w") as f:
+            f.write(str(self._read_generation(dataset_name) + 1))
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+    def _sync_generation(self, dataset_name):
+        """
+        Reloads the dataset when its delta generation moved since it was loaded, i.e. when this or another
+        worker appended rows or folded the deltas into the base files.
+        """
+        signature = self.file_signatures.get(dataset_name)
+        if signature is None or self._read_generation(dataset_name) == signature[3]:
+            return
+
+        with self._reload_lock:
+            signature = self.file_signatures.get(dataset_name)
+            if self._read_generation(dataset_name) == signature[3]:
+                return  # Reloaded by another thread meanwhile
+            with self._dataset_lock(dataset_name):
+                signature = self._dataset_signature(dataset_name)
+            self._swap(self._build_datasets({dataset_name: signature}), {dataset_name: signature})
+
+    @contextmanager
+    def _dataset_lock(self, dataset_name, exclusive = False, blocking = True):
+        """
+        Cross-process file lock on a dataset's delta directory. Readers share it, the delta compaction holds it
+        exclusively while it swaps the base files and removes the folded deltas. Yields whether it was acquired.
+        """
+        delta_dir = self._delta_dir(dataset_name)
+        if not os.path.isdir(delta_dir):
+            yield True
+            return
+
+        with open(os.path.join(delta_dir, ".lock"), "a") as lock_file:
+            flags = (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | (0 if blocking else fcntl.LOCK_NB)
+            try:
+                fcntl.flock(lock_file, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def append_rows(self, dataset_name, df):
+        """
+        Appends new rows (e.g. a day of payments) to a dataset by writing them as a delta file,
+        without rewriting the dataset. Every worker serves them from its next query of the dataset on.
+        """
+        if dataset_name not in self.file_names:
+            raise ValueError(f"Dataset '{dataset_name}' not found.")
+
+        delta_dir = self._delta_dir(dataset_name)
+        os.makedirs(delta_dir, exist_ok = True)
+        path = os.path.join(delta_dir, f"delta-{time.time_ns():020d}-{os.getpid()}.parquet")
+        df.write_parquet(f"{path}.tmp")
+        with self._dataset_lock(dataset_name, exclusive = True):
+            os.replace(f"{path}.tmp", path)
+            self._bump_generation(dataset_name)
+        return path
+
+    def compact_deltas(self, dataset_name):
+        """
+        Folds the dataset's delta files into its base files. A partitioned base only rewrites the FY
+        partitions that received rows. Returns False if there was nothing to do or another worker holds the lock.
+
+        The swap bumps the delta generation, so every worker reloads the new base files without the folded
+        deltas before its next query (a lazy query already running may still fail on the replaced files).
+        CSV bases are rejected: convert them to parquet first.
+        """
+        with self._dataset_lock(dataset_name, exclusive = True, blocking = False) as acquired:
+            delta_files = self._delta_files(dataset_name)
+            if not acquired or not delta_files:
+                return False
+
+            path = self._full_path(dataset_name)
+            if path.endswith(".csv"):
+                raise ValueError(f"Can't fold deltas into the CSV source of '{dataset_name}'; convert it to parquet first.")
+            deltas = pl.concat([pl.read_parquet(f) for f in delta_files], how = "diagonal_relaxed")
+            fy_col = FY_COLUMNS.get(dataset_name)
+
+            if os.path.isdir(path) and fy_col:
+                for (fy,), rows in deltas.group_by(fy_col):
+                    part_dir = os.path.join(path, f"{fy_col}={HIVE_NULL_PARTITION if fy is None else fy}")
+                    self._replace_parquet(part_dir, rows.drop(fy_col))
+            else:
+                self._replace_parquet(path, deltas)
+
+            for f in delta_files:
+                os.remove(f)
+            self._bump_generation(dataset_name)
+
+        self._sync_generation(dataset_name)
+        return True
+
+    def _replace_parquet(self, path, new_rows):
+        """
+        Rewrites a parquet file (or a partition directory, as a single part-0.parquet) with the new rows appended.
+        """
+        existing = data_files(path) if os.path.isdir(path) else [path] if os.path.exists(path) else []
+        frames = [pl.read_parquet(f, hive_partitioning = False) for f in existing] + [new_rows]
+        df = pl.concat(frames, how = "diagonal_relaxed")
+
+        target = os.path.join(path, "part-0.parquet") if os.path.isdir(path) or not path.endswith(".parquet") else path
+        os.makedirs(os.path.dirname(target), exist_ok = True)
+        df.write_parquet(f"{target}.tmp", compression = "zstd", statistics = True)
+        for f in existing:
+            if f != target:
+                os.remove(f)
+        os.replace(f"{target}.tmp", target)
+
+    def start_delta_compactor(self, interval):
+        """
+        Starts a daemon thread that folds delta files into the base files every `interval` seconds.
+        Requires the data file watcher, which reloads workers that sit idle through a compaction.
+        """
+        if self._delta_compactor is not None:
+            return
+        if self._watcher is None:
+            raise ValueError("The delta compactor requires the data file watcher: set OFTW_WATCH_INTERVAL as well.")
+
+        def compact():
+            while True:
+                time.sleep(interval)
+                for name in self.file_names:
+                    try:
+                        self.compact_deltas(name)
+                    except Exception as e:
+                        print(f"Error compacting deltas of {name}: {e}")
+
+        self._delta_compactor = threading.Thread(target = compact, name = "delta-compactor", daemon = True)
+        self._delta_compactor.start()
+
+    def get_data_version(self, dataset_name = None):
+        """
+        Returns the monotonically increasing version of the loaded data, or of a single dataset
+        (reloading it first if its delta generation moved).
+        """
+        if dataset_name is None:
+            return self.data_version
+        self._sync_generation(dataset_name)
+        return self.dataset_versions.get(dataset_name, 0)
+
+    def get_column_stats(self, dataset_name, column_name):
+        """
+        Returns the statistics of a column: rows, null_count, min, max, n_unique and the sorted non-null
+        values. They are computed once per data version, from the parquet footers where possible,
+        and the distinct values (and n_unique) only when first read from the returned ColumnStats.
+        """
+        version = self.get_data_version(dataset_name)
+        with self._stats_lock:
+            cached = self._stats.get(dataset_name)
+        if cached is None or cached[0] != version:
+            cached = (version,) + self._compute_stats(dataset_name)
+            with self._stats_lock:
+                self._stats[dataset_name] = cached
+
+        _, rows, columns = cached
+        if column_name not in columns:
+            raise ValueError(f"Column '{column_name}' not found in dataset '{dataset_name}'.")
+
+        stats = columns[column_name]
+
+        def compute_values():
+            if "values" not in stats:
+                values = (self.get_data(dataset_name, columns = [column_name])
+                    .select(pl.col(column_name).drop_nulls().unique())
+                    .with_columns(pl.col(pl.Categorical).cast(pl.String))
+                    .sort(column_name)
+                    .collect().to_series().to_list())
+                stats.update(values = values, n_unique = len(values))
+            return {"values": stats["values"], "n_unique": stats["n_unique"]}
+
+        return ColumnStats({"rows": rows, **stats}, compute_values)
+
+    def _compute_stats(self, dataset_name):
         """
-        for name, path in file_names.items():
-            full_path = os.path.join(self.dir_name, path)
-            self.dataframes[name] = self._load_file(full_path)
+        Returns (rows, {column: {"null_count", "min", "max"}}) of a dataset.
+        """
+        self._rw_lock.acquire_read()
+        try:
+            data = self.dataframes.get(dataset_name)
+            deltas = self.deltas.get(dataset_name)
+        finally:
+            self._rw_lock.release_read()
+        if data is None:
+            raise ValueError(f"Dataset '{dataset_name}' not found.")
+
+        path = self._full_path(dataset_name)
+        rows, columns = None, {}
+        if isinstance(data, pl.LazyFrame) and deltas is None and not path.endswith(".csv"):
+            rows, columns = parquet_footer_stats(data_files(path))
+
+        lf = self.get_data(dataset_name).with_columns(pl.col(pl.Categorical).cast(pl.String))
+        scan_cols = [col for col in lf.collect_schema().names() if col not in columns]
+        if scan_cols or rows is None:
+            row = lf.select(
+                [pl.len().alias("__rows")]
+                + [pl.col(col).null_count().alias(f"{col}__null_count") for col in scan_cols]
+                + [pl.col(col).min().alias(f"{col}__min") for col in scan_cols]
+                + [pl.col(col).max().alias(f"{col}__max") for col in scan_cols]
+            ).collect().row(0, named = True)
+            rows = row["__rows"]
+            for col in scan_cols:
+                columns[col] = {"null_count": row[f"{col}__null_count"], "min": row[f"{col}__min"], "max": row[f"{col}__max"]}
+        return rows, columns
 
-    def _load_file(self, path):
+    def _load_file(self, path, dataset_name = None):
         """
-        Detects the file type (CSV or Parquet) and loads it lazily.
+        Detects the file type (CSV, Parquet or a hive-partitioned Parquet directory) and loads it lazily.
         """
-        if path.endswith('.csv'):
-            return pl.scan_csv(path)  # Lazy CSV loading
+        if os.path.isdir(path):
+            return pl.scan_parquet(os.path.join(path, "**", "*.parquet"), hive_partitioning = True, hive_schema = self._hive_schema(path))
+        elif path.endswith('.csv'):
+            return pl.scan_parquet(self._convert_csv(dataset_name or Path(path).stem, path))  # Parquet copy of the CSV
         elif path.endswith('.parquet'):
             return pl.scan_parquet(path)  # Lazy Parquet loading
         else:
             raise ValueError(f"Unsupported file format: {path}")
 
-    def get_data(self, dataset_name):
-        if dataset_name not in self.dataframes:
-            raise ValueError(f"Dataset '{dataset_name}' not found.")
-        return self.dataframes[dataset_name]
+    def _convert_csv(self, dataset_name, path):
+        """
+        Returns the cached parquet copy of a CSV source, converting it first if the CSV changed.
+        The conversion streams through sink_parquet, so the CSV never has to fit in memory.
+        """
+        cache_dir = os.path.join(self.dir_name, CSV_CACHE_DIR)
+        cache_path = os.path.join(cache_dir, f"{dataset_name}-{file_hash(path)}.parquet")
+        if os.path.exists(cache_path):
+            return cache_path
+
+        schema = CSV_SCHEMAS.get(dataset_name)
+        if schema:
+            header = pl.scan_csv(path, infer_schema = False).collect_schema().names()
+            missing = [col for col in schema if col not in header]
+            if missing:
+                raise ValueError(f"CSV source {path} is missing the declared columns: {', '.join(missing)}")
+            lf = pl.scan_csv(path, infer_schema = False, schema_overrides = schema)
+        else:
+            lf = pl.scan_csv(path, infer_schema = False)
+
+        # Workers may race to convert the same CSV; each writes its own file and the rename is atomic
+        os.makedirs(cache_dir, exist_ok = True)
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        lf.sink_parquet(tmp_path, compression = "zstd", statistics = True)
+        os.replace(tmp_path, cache_path)
+
+        for old_cache in Path(cache_dir).glob(f"{dataset_name}-*.parquet"):
+            if str(old_cache) != cache_path:
+                old_cache.unlink(missing_ok = True)
+        return cache_path
+
+    def _hive_schema(self, path):
+        """
+        Partition keys are always read as strings (FY labels), whatever polars would infer from them.
+        """
+        keys = {}
+        for entry in Path(path).rglob("*=*"):
+            if entry.is_dir():
+                keys[entry.name.split("=", 1)[0]] = pl.String
+        return keys
+
+    def _list_partitions(self, dataset_name, path):
+        """
+        Maps each FY of a directory partitioned on the dataset's FY column to its files: {fy: [files]}.
+        """
+        fy_col = FY_COLUMNS.get(dataset_name)
+        if not fy_col or not os.path.isdir(path):
+            return {}
+
+        partitions = {}
+        for file in data_files(path):
+            for part in Path(file).relative_to(path).parts[:-1]:
+                key, _, value = part.partition("=")
+                if key == fy_col:
+                    fy = None if value == HIVE_NULL_PARTITION else unquote(value)
+                    partitions.setdefault(fy, []).append(file)
+        return partitions
+
+    def _materialize(self, dataset_name, lf, sort_order = None):
+        """
+        Decodes the dataset once into memory. Rows are clustered by the dataset's FY column,
+        so each FY occupies one contiguous row range: {fy: (offset, length)}.
+        """
+        fy_col = FY_COLUMNS.get(dataset_name)
+        if fy_col is None:
+            return self._compact_dtypes(lf.collect()), {}
+
+        if (sort_order or {}).get("sorted_by", [None])[0] != fy_col:
+            lf = lf.sort(fy_col, nulls_last = True, maintain_order = True)   # Already clustered when compacted
+        df = self._compact_dtypes(lf.collect().rechunk())
+
+        return df, self._build_fy_index(df, fy_col)
+
+    def _build_fy_index(self, df, fy_col):
+        fy_index = {}
+        offset = 0
+        for run in df.get_column(fy_col).rle().to_list():
+            if run["value"] is not None:
+                fy_index[run["value"]] = (offset, run["len"])
+            offset += run["len"]
+        return fy_index
+
+    def _load_snapshot(self, dataset_name, lf, sort_order, signature):
+        """
+        Memory-maps the dataset's Arrow IPC snapshot, writing it first if no worker has yet.
+        Snapshots are named after the content hash of their source, so a reload maps a new file
+        while workers still reading the old one keep their mapping.
+        """
+        snapshot_dir = os.path.join(self.dir_name, SNAPSHOT_DIR)
+        dtype_tag = "compact" if self.optimize_dtypes else "raw"
+        snapshot_path = os.path.join(snapshot_dir, f"{dataset_name}-{signature[2]}-{dtype_tag}.arrow")
+
+        if not os.path.exists(snapshot_path):
+            df, _ = self._materialize(dataset_name, lf, sort_order)
+            os.makedirs(snapshot_dir, exist_ok = True)
+
+            # Workers may race to write the same snapshot; each writes its own file and the rename is atomic
+            tmp_path = f"{snapshot_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            df.write_ipc(tmp_path, compression = "uncompressed")
+            os.replace(tmp_path, snapshot_path)
+
+            for old_snapshot in Path(snapshot_dir).glob(f"{dataset_name}-*.arrow"):
+                if str(old_snapshot) != snapshot_path:
+                    old_snapshot.unlink(missing_ok = True)
+
+        df = pl.read_ipc(snapshot_path, memory_map = True)
+        fy_col = FY_COLUMNS.get(dataset_name)
+        return df, self._build_fy_index(df, fy_col) if fy_col else {}
+
+    def _compact_dtypes(self, df):
+        """
+        Shrinks a resident frame: low-cardinality strings become Categorical (declared by name suffix or
+        inferred from their distinct ratio) and integers are downcast to the smallest type of the same
+        signedness that holds their range. Filters such as `is_in` then compare integer codes.
+        """
+        if not self.optimize_dtypes or df.height == 0:
+            return df
+
+        string_cols = [col for col, dtype in df.schema.items() if dtype == pl.String]
+        int_cols = [col for col, dtype in df.schema.items() if dtype.is_integer()]
+
+        stats = df.select(
+            [pl.col(col).n_unique().alias(f"{col}__n_unique") for col in string_cols if not col.endswith(CATEGORICAL_SUFFIXES)]
+            + [pl.col(col).min().alias(f"{col}__min") for col in int_cols]
+            + [pl.col(col).max().alias(f"{col}__max") for col in int_cols]
+        ).row(0, named = True) if string_cols or int_cols else {}
+
+        casts = {}
+        for col in string_cols:
+            if col.endswith(CATEGORICAL_SUFFIXES) or stats[f"{col}__n_unique"] <= CATEGORICAL_MAX_DISTINCT_RATIO * df.height:
+                casts[col] = CATEGORICAL
+
+        for col in int_cols:
+            low, high = stats[f"{col}__min"], stats[f"{col}__max"]
+            if low is None:
+                continue
+            candidates = UNSIGNED_INTS if df.schema[col].is_unsigned_integer() else SIGNED_INTS
+            for dtype in candidates:
+                info = self._int_range(dtype)
+                if info[0] <= low and high <= info[1]:
+                    if dtype != df.schema[col]:
+                        casts[col] = dtype
+                    break
+
+        return df.cast(casts) if casts else df
+
+    def _int_range(self, dtype):
+        bits = {pl.Int8: 8, pl.Int16: 16, pl.Int32: 32, pl.Int64: 64, pl.UInt8: 8, pl.UInt16: 16, pl.UInt32: 32, pl.UInt64: 64}[dtype]
+        if dtype in UNSIGNED_INTS:
+            return (0, 2 ** bits - 1)
+        return (-(2 ** (bits - 1)), 2 ** (bits - 1) - 1)
+
+    def get_fy_column(self, dataset_name):
+        """
+        Returns the FY column the dataset is indexed on, or None.
+        """
+        return FY_COLUMNS.get(dataset_name)
+
+    def get_data(self, dataset_name, fy_values = None, columns = None):
+        """
+        Returns the dataset as a LazyFrame.
+
+        Parameters:
+        - dataset_name (str): Dataset to return.
+        - fy_values (list of str): Optional fiscal years to restrict the rows to. In materialized
+          mode this is a zero-copy slice of the resident frame instead of a filter over all rows,
+          and for a partitioned directory only the matching partitions are scanned.
+        - columns (list of str): Optional columns the query will reference. A star schema dataset
+          only joins the dimensions those columns come from.
+        """
+        self._sync_generation(dataset_name)
+        self._rw_lock.acquire_read()
+        try:
+            if dataset_name not in self.dataframes:
+                raise ValueError(f"Dataset '{dataset_name}' not found.")
+
+            data = self.dataframes[dataset_name]
+            fy_index = self.fy_index.get(dataset_name, {})
+            partitions = self.partitions.get(dataset_name, {})
+            sort_order = self.sort_orders.get(dataset_name, {})
+            deltas = self.deltas.get(dataset_name)
+            if isinstance(data, StarView):
+                tables = {name: self.dataframes[name] for name in [data.facts, *data.dimensions]}
+        finally:
+            self._rw_lock.release_read()
+
+        if isinstance(data, StarView):
+            lf = self._join_star(data, tables, fy_values, fy_index, columns)
+        else:
+            lf = self._select_fy(data, self.get_fy_column(dataset_name), fy_values, fy_index, partitions, deltas)
+        return self._set_sorted(lf, sort_order, single_fy = fy_values is not None and len(set(fy_values)) == 1, columns = columns)
+
+    def select_rows(self, dataset_name, canonical, columns = None):
+        """
+        Serves a filter from the dataset's bitmap index: the indexed conjuncts of the canonical filter
+        become one row selection, gathered from the resident frame in a single pass.
+
+        Returns:
+        - tuple: (LazyFrame of the selected rows, remaining canonical filter to apply on it), or None when
+          the dataset is not resident or only its FY column is filtered (served by the FY slices instead).
+        """
+        self._rw_lock.acquire_read()
+        try:
+            data = self.dataframes.get(dataset_name)
+            sort_order = self.sort_orders.get(dataset_name, {})
+        finally:
+            self._rw_lock.release_read()
+        if not isinstance(data, pl.DataFrame) or dataset_name not in BITMAP_COLUMNS:
+            return None
+
+        version = self.get_data_version(dataset_name)
+        with self._bitmap_lock:
+            cached = self._bitmap_indexes.get(dataset_name)
+            if cached is None or cached[0] != version:
+                cached = (version, BitmapIndex(data, BITMAP_COLUMNS[dataset_name]))
+                self._bitmap_indexes[dataset_name] = cached
+
+        rows, resolved_columns, remaining = cached[1].select(canonical)
+        if rows is None or resolved_columns == [self.get_fy_column(dataset_name)]:
+            return None
+
+        df = data.select(columns) if columns else data
+        return self._set_sorted(df[rows].lazy(), sort_order, columns = columns), remaining
+
+    def estimate_size(self, dataset_name, fy_values = None, columns = None):
+        """
+        Estimates the bytes a query on the dataset reads: the in-memory size of the (FY sliced) resident
+        columns, or the uncompressed parquet size of the scanned files and columns. Without partitions
+        an FY filter can't narrow the files, so the whole file is counted.
+        """
+        self._rw_lock.acquire_read()
+        try:
+            if dataset_name not in self.dataframes:
+                raise ValueError(f"Dataset '{dataset_name}' not found.")
+            data = self.dataframes[dataset_name]
+            fy_index = self.fy_index.get(dataset_name, {})
+            partitions = self.partitions.get(dataset_name, {})
+            deltas = self.deltas.get(dataset_name)
+            if isinstance(data, StarView):
+                data = self.dataframes[data.facts]
+        finally:
+            self._rw_lock.release_read()
+
+        if isinstance(data, pl.DataFrame):
+            df = data.select([col for col in columns if col in data.columns]) if columns else data
+            size = df.estimated_size()
+            if fy_values is not None and fy_index and data.height:
+                size = size * sum(fy_index.get(fy, (0, 0))[1] for fy in set(fy_values)) // data.height
+            return size
+
+        path = self._full_path(dataset_name)
+        if fy_values is not None and partitions:
+            files = [f for fy in set(fy_values) for f in partitions.get(fy, [])]
+        elif path.endswith(".csv"):
+            files = [self._convert_csv(dataset_name, path)]
+        else:
+            files = data_files(path)
+
+        sizes = parquet_column_sizes(files)
+        size = sum(size for col, size in sizes.items() if not columns or col in columns)
+        if deltas is not None:
+            size += (deltas.select([col for col in columns if col in deltas.columns]) if columns else deltas).estimated_size()
+        return size
+
+    def _join_star(self, view, tables, fy_values, fy_index, columns = None):
+        """
+        Rebuilds a star schema dataset from its (FY sliced) fact table, joining only the needed dimensions.
+        """
+        lf = self._select_fy(tables[view.facts], view.fy_col, fy_values, fy_index, {})
+
+        # Extra dimension columns (e.g. integer calendar keys) are only returned when asked for
+        extra_columns = [col for _, dim_cols in view.dimensions.values() for col in dim_cols if col not in view.columns]
+        needed = view.columns if columns is None else [col for col in view.columns + extra_columns if col in columns]
+
+        for dim_name, (key, dim_cols) in view.dimensions.items():
+            if any(col in dim_cols for col in needed):
+                lf = lf.join(tables[dim_name].lazy(), on = key, how = "left", maintain_order = "left")
+
+        return lf.select(needed)
+
+    def _select_fy(self, data, fy_col, fy_values, fy_index, partitions, deltas = None):
+
+        if fy_values is not None:
+            # Slices are concatenated in the layout's order (FY ascending, nulls last), so the sorted flags
+            # _set_sorted sets hold whatever order the caller listed the FYs in
+            fy_values = sorted(set(fy_values), key = lambda fy: (fy is None, fy or ""))
+
+        if isinstance(data, pl.LazyFrame):
+            if fy_values is not None and partitions:
+                # Partition pruning: only the selected FY directories are scanned
+                files = [f for fy in fy_values for f in partitions.get(fy, [])]
+                frames = [pl.scan_parquet(files, hive_partitioning = True, hive_schema = {fy_col: pl.String})] if files else []
+                if deltas is not None:
+                    frames.append(deltas.lazy().filter(pl.col(fy_col).is_in(fy_values)))
+                if not frames:
+                    return data.clear()
+                return pl.concat(frames, how = "diagonal_relaxed")
+            if fy_values is not None and fy_col:
+                return data.filter(pl.col(fy_col).is_in(fy_values))
+            return data
+
+        if fy_values is not None and fy_col:
+            slices = [data.slice(*fy_index[fy]) for fy in fy_values if fy in fy_index]
+            if not slices:
+                return data.clear().lazy()
+            return pl.concat(slices, rechunk = False).lazy()
+
+        return data.lazy()
+
+    def _set_sorted(self, lf, sort_order, single_fy = False, columns = None):
+        """
+        Flags the columns a compacted file is known to be sorted by, so polars can skip re-sorting them.
+        Within a single FY the secondary sort key (e.g. payment_date_fm) is sorted as well.
+        """
+        sorted_columns = sort_order.get("sorted_columns", []) + (sort_order.get("sorted_within_fy", []) if single_fy else [])
+        for col in dict.fromkeys(sorted_columns):
+            if columns is None or col in columns:
+                lf = lf.set_sorted(col)
+        return lf
 
     def get_default_target_data(self):
         return {
@@ -72,4 +1156,4 @@ parquet_files = {
     "pledge_attrition": "pledge_attrition.parquet",
 }
 
-data_loader = DataLoader(parquet_files)
\ No newline at end of file
+data_loader = DataLoader(parquet_files)
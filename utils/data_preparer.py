@@ -2,6 +2,7 @@ import polars as pl
 
 import openai
 import os
+from concurrent.futures import CancelledError
 from pathlib import Path
 
 import json
@@ -12,12 +13,28 @@ from PIL import Image
 from io import BytesIO
 
 from utils.data_loader import data_loader
+from utils.query_cache import query_cache
+from utils.filter_compiler import MATCH_ALL, compile_filter, filter_columns, normalize_filters
+from utils.resources import query_slot
+from utils.admission import admission_controller
+from utils.cancellation import cancellable_collect, check_cancelled
 
 # Set up OpenAI API (ensure this is your valid API key)
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
 LOGO_DIR = (Path(__file__)/'..'/'..'/'data/downloaded_logos/').resolve()
 
+# Set OFTW_EXECUTION_MODE to "memory" or "streaming" to run every query on that polars engine. By default ("auto"),
+# queries estimated to read more than OFTW_STREAMING_THRESHOLD_MB run on the streaming engine in bounded memory
+EXECUTION_MODE = os.getenv("OFTW_EXECUTION_MODE", "auto")
+STREAMING_THRESHOLD_MB = float(os.getenv("OFTW_STREAMING_THRESHOLD_MB", "512"))
+
+# Set OFTW_SPILL_DIR to where the streaming engine spills to disk (POLARS_TEMP_DIR, the system temp directory by default)
+SPILL_DIR = os.getenv("OFTW_SPILL_DIR")
+if SPILL_DIR:
+    os.makedirs(SPILL_DIR, exist_ok = True)
+    os.environ.setdefault("POLARS_TEMP_DIR", SPILL_DIR)
+
 class DataPreparer:
     def __init__(self):
         pass
@@ -26,15 +43,14 @@ class DataPreparer:
         """
         Retrieves the unique list of column from the dataset.
         """
-        lf = data_loader.get_data(dataset_name)
-        return lf.filter(pl.col(col_name).is_not_null()).select(col_name).unique().sort(by = col_name, descending = sort_desc).collect().to_series().to_list()
+        values = data_loader.get_column_stats(dataset_name, col_name)["values"]
+        return values[::-1] if sort_desc else list(values)
     
     def get_unique_col_count(self, dataset_name, col_name):
         """
         Retrieves the count of unique values in the column.
         """
-        lf = data_loader.get_data(dataset_name)
-        return lf.filter(pl.col(col_name).is_not_null()).select(pl.col(col_name).n_unique()).collect().item()
+        return data_loader.get_column_stats(dataset_name, col_name)["n_unique"]
     
     def get_col_unique_values_lf(self, lf, column_name):
         """
@@ -47,7 +63,7 @@ class DataPreparer:
         Returns:
         list: A list of unique values in the specified column.
         """
-        return lf.filter(pl.col(column_name).is_not_null()).select(column_name).unique().sort(by = column_name).collect().to_series().to_list()
+        return self.collect(lf.filter(pl.col(column_name).is_not_null()).select(column_name).unique().sort(by = column_name)).to_series().to_list()
     
     def get_unique_col_count_lf(self, lf, column_name):
         """
@@ -60,7 +76,63 @@ class DataPreparer:
         Returns:
         list: A total count of unique values in the specified column.
         """
-        return lf.filter(pl.col(column_name).is_not_null()).select(pl.col(column_name).n_unique()).collect().item()
+        return self.collect(self.get_unique_col_count_query(lf, column_name)).item()
+
+    def get_unique_col_count_query(self, lf, column_name):
+        """
+        Lazy form of get_unique_col_count_lf, to be collected with other queries through collect_batch.
+        """
+        return lf.filter(pl.col(column_name).is_not_null()).select(pl.col(column_name).n_unique())
+
+    def collect_batch(self, queries, input_size = None):
+        """
+        Collects several lazy queries in one pl.collect_all call, so the subplans they share
+        (e.g. the scan and filter of one FY slice) are executed once.
+
+        Parameters:
+        - queries (dict): {name: LazyFrame}.
+        - input_size (int): Estimated bytes the queries read, to pick the engine (see get_engine).
+
+        Returns:
+        - dict: {name: DataFrame}.
+        """
+        names = list(queries)
+        # pl.collect_all can't run in the background, so a cancelled request only stops before or after the batch
+        check_cancelled()
+        with query_slot(input_size):
+            results = pl.collect_all([queries[name] for name in names], engine = self.get_engine(input_size))
+        check_cancelled()
+        return dict(zip(names, results))
+
+    def get_engine(self, input_size = None):
+        """
+        Returns the polars engine for a query reading about `input_size` bytes: "streaming" above
+        STREAMING_THRESHOLD_MB (or always / never, per EXECUTION_MODE), else "in-memory".
+        """
+        if EXECUTION_MODE not in ["auto", "memory", "streaming"]:
+            raise ValueError(f"Unsupported execution mode: {EXECUTION_MODE}")
+        if EXECUTION_MODE == "streaming" or (EXECUTION_MODE == "auto" and input_size is not None and input_size > STREAMING_THRESHOLD_MB * 1024 * 1024):
+            return "streaming"
+        return "in-memory"
+
+    def collect(self, lf, input_size = None):
+        """
+        Collects a query on the engine get_engine picks for its estimated input size. Heavy queries
+        take one of the worker's heavy query slots (see utils.resources) while they run. Inside a
+        cancellable callback, the query is cancelled with the callback (see utils.cancellation).
+        """
+        with query_slot(input_size):
+            return cancellable_collect(lf, engine = self.get_engine(input_size))
+
+    def estimate_input_size(self, dataset_name, filters = None, columns = None, logic = "AND"):
+        """
+        Estimates the bytes filter_data(dataset_name, filters, columns, logic) reads, from its FY
+        selection and referenced columns.
+        """
+        canonical = normalize_filters(filters, logic)
+        fy_values, _ = self._split_fy_filters(dataset_name, canonical)
+        referenced_columns = list(dict.fromkeys(list(columns) + filter_columns(canonical))) if columns else None
+        return data_loader.estimate_size(dataset_name, fy_values, referenced_columns)
     
     def get_column_max_value(self, dataset_name, column_name):
         """
@@ -73,7 +145,7 @@ class DataPreparer:
         Returns:
         list: A list of unique values in the specified column.
         """
-        return data_loader.get_data(dataset_name).filter(pl.col(column_name).is_not_null()).select(pl.col(column_name).max()).collect().item()
+        return data_loader.get_column_stats(dataset_name, column_name)["max"]
 
     def filter_data(self, dataset_name, filters = None, columns = None, logic = "AND"):
         """
@@ -81,57 +153,75 @@ class DataPreparer:
 
         Parameters:
         - dataset_name (str): Dataset to query.
-        - filters (list of tuples): [(canonical_name, operator, value)], e.g., [("center_id", "==", 123)].
+        - filters (list): [(canonical_name, operator, value)], e.g., [("center_id", "==", 123)]. Filters can be
+          grouped with ("AND", [...]), ("OR", [...]) and ("NOT", filter). Operators: ==, !=, >, >=, <, <=,
+          in, not_in, null, not_null, between (value is (low, high), inclusive), starts_with and not_starts_with.
         - columns (list of str): Canonical column names to return.
         - logic (str): "AND" (default) or "OR" for combining filters.
 
         Returns:
-        - LazyFrame: Filtered and projected dataset.
+        - LazyFrame: Filtered and projected dataset. With the query cache enabled, it wraps a
+          collected result that is shared by every identical query on the same data version.
         """
-        lf = data_loader.get_data(dataset_name)
+        canonical = normalize_filters(filters, logic)
+
+        cache_key = None
+        if query_cache.enabled:
+            cache_key = query_cache.make_key(dataset_name, canonical, columns, data_loader.get_data_version(dataset_name))
+            cached = query_cache.get(cache_key)
+            if cached is not None:
+                return cached.lazy()
+
+        referenced_columns = None
+        if columns:
+            referenced_columns = list(dict.fromkeys(list(columns) + filter_columns(canonical)))
+
+        # Filters on indexed columns are resolved by bitmap algebra into one gather of the matching rows
+        selection = data_loader.select_rows(dataset_name, canonical, referenced_columns) if canonical != MATCH_ALL else None
+        fy_values = None
+        if selection is not None:
+            lf, canonical = selection
+        else:
+            fy_values, canonical = self._split_fy_filters(dataset_name, canonical)
+            lf = data_loader.get_data(dataset_name, fy_values, referenced_columns)
 
         # Apply filters if provided
-        if filters:
-            expressions = [self._build_filter_expr(dataset_name, f) for f in filters]
-            # print(expressions)
-            # combined_filter = pl.all(expressions) if logic == "AND" else pl.any(expressions)
-            # print(combined_filter)
-            lf = lf.filter(expressions)
+        if canonical != MATCH_ALL:
+            lf = lf.filter(compile_filter(canonical))
 
         # Select required columns
         if columns:
             lf = lf.select(columns)
 
+        if cache_key is not None:
+            df = self.collect(lf, data_loader.estimate_size(dataset_name, fy_values, referenced_columns))
+            query_cache.put(cache_key, df)
+            return df.lazy()
+
         return lf
 
-    def _build_filter_expr(self, dataset_name, filter_tuple):
+    def _split_fy_filters(self, dataset_name, canonical):
         """
-        Helper to convert (canonical_name, operator, value) to a Polars expression.
+        Separates the top-level "==" / "in" filters on the dataset's FY column, so the data loader can serve
+        those fiscal years directly. Returns (fy_values or None, remaining canonical filter).
         """
-        col_name, operator, value = filter_tuple
-
-        # Handle None values
-        if operator in ["not_null", "null"]:
-            if operator == "not_null":
-                return pl.col(col_name).is_not_null()
-            elif operator == "null":
-                return pl.col(col_name).is_null()
-        
-        ops = {
-            "==": pl.col(col_name) == value,
-            "!=": pl.col(col_name) != value,
-            ">": pl.col(col_name) > value,
-            ">=": pl.col(col_name) >= value,
-            "<": pl.col(col_name) < value,
-            "<=": pl.col(col_name) <= value,
-            "in": pl.col(col_name).is_in(value) if isinstance(value, list) else pl.col(col_name) == value,
-            "not_in": ~pl.col(col_name).is_in(value) if isinstance(value, list) else pl.col(col_name) != value,
-        }
-
-        if operator not in ops:
-            raise ValueError(f"Unsupported operator: {operator}")
-
-        return ops[operator]
+        fy_col = data_loader.get_fy_column(dataset_name)
+        conjuncts = canonical[1] if canonical[0] == "and" else (canonical,)
+        fy_values = None
+        remaining = []
+
+        for f in conjuncts:
+            if f[0] == "filter" and f[1] == fy_col and f[2] in ["==", "in"] and f[3] is not None:
+                values = list(f[3]) if f[2] == "in" else [f[3]]
+                fy_values = values if fy_values is None else [v for v in fy_values if v in values]
+            else:
+                remaining.append(f)
+
+        if fy_values is None:
+            return None, canonical
+        if len(remaining) == 1:
+            return fy_values, remaining[0]
+        return fy_values, ("and", tuple(remaining))
     
     def get_llm_insight(self, plotly_fig_data):
         """
@@ -153,18 +243,26 @@ class DataPreparer:
             Use plain language and keep it concise. 
         """.format(plotly_fig_data)
 
+        # Don't pay for an insight into a chart the user has already moved on from
+        check_cancelled()
         try:
-            response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=400,
-                n=1,
-                stop=None,
-                temperature=0.7,
-            )
+            # LLM calls are the slowest requests; they queue behind chart refreshes and give up when the queue is long
+            with admission_controller.slot("insight"):
+                response = openai.chat.completions.create(
+                    model="gpt-3.5-turbo",
+                    messages=[
+                        {"role": "user", "content": prompt}
+                    ],
+                    max_tokens=400,
+                    n=1,
+                    stop=None,
+                    temperature=0.7,
+                )
             return response.choices[0].message.content
+        except TimeoutError:
+            return "The insight service is busy, please try again in a moment."
+        except CancelledError:
+            raise   # Superseded while queued for the insight slot; the callback keeps the current output
         except Exception as e:
             print(f"Error in LLM insight retrieval: {e}")
             # Handle error (e.g., log it, raise it, etc.)
@@ -119,7 +119,18 @@ class Figure:
 
         return trace
 
-    def create_kpi_card(self, value, goal, body_text = "Funds Raised", value_type = "$"):
+    def create_kpi_card(self, value, goal, body_text = "Funds Raised", value_type = "$", prior_value = None, prior_text = "same day last FY"):
+        comparison = []
+        if prior_value:
+            change = value / prior_value - 1
+            comparison.append(html.P(
+                f"{change:+.1%} vs {prior_text} (${prior_value:,.2f})",
+                style={
+                    'textAlign': 'center',
+                    'color': self.colors['primary'] if change >= 0 else self.colors['secondary'],
+                    'fontSize': '12px'
+                }))
+
         return html.Div([
         html.H3(f"${value:,.2f}" if value_type == "$" else f"{value:,.1f}%", 
                 style={
@@ -139,8 +150,8 @@ class Figure:
                 'textAlign': 'center',
                 'color': self.colors['secondary'],
                 'fontSize': '14px'
-            })
-    ])
+            }),
+    ] + comparison)
 
     def create_absolute_value_kpi_card(self, value, goal, body_text = "Funds Raised",):
         return html.Div([
@@ -516,7 +527,7 @@ class Figure:
     def create_calendarplot(self, df: pl.DataFrame) -> go.Figure:
         """
         """
-        pdf = df.to_pandas()
+        pdf = df.with_columns(pl.col(pl.Categorical).cast(pl.String)).to_pandas()
 
         pivot = pdf.pivot_table(
             index="payment_date_day_of_week",
@@ -582,7 +593,7 @@ class Figure:
 
         return fig
     
-    def create_mm_monthly_trendline(self, money_moved_lf, selected_amount_type, selected_drilldown_by):
+    def create_mm_monthly_trendline(self, money_moved_lf, selected_amount_type, selected_drilldown_by, input_size = None):
         fig = go.Figure()
         if selected_drilldown_by:
             lf = (money_moved_lf
@@ -595,9 +606,9 @@ class Figure:
                 .sort("payment_date_fm")
             )
 
-            unique_traces = data_preparer.get_col_unique_values_lf(lf, selected_drilldown_by)
-
-            df = lf.collect()
+            # One query per chart: the traces are the drilldown values of the collected frame
+            df = data_preparer.collect(lf, input_size)
+            unique_traces = df[selected_drilldown_by].drop_nulls().unique().sort().to_list()
 
             for trace in unique_traces:
                 trace_df = df.filter(pl.col(selected_drilldown_by) == trace).sort("payment_date_fm")
@@ -619,7 +630,7 @@ class Figure:
                     )
                 )
         else:
-            df = (money_moved_lf
+            monthly_lf = (money_moved_lf
                 .group_by(["payment_date_fm"])
                 .agg([
                     pl.col(selected_amount_type).sum().alias("money_moved_monthly"),
@@ -627,8 +638,8 @@ class Figure:
                     pl.col(["payment_date_calendar_month", "payment_date_calendar_monthyear"]).first(),
                 ])
                 .sort("payment_date_fm")
-                .collect()
             )
+            df = data_preparer.collect(monthly_lf, input_size)
 
             y_vals = df["money_moved_monthly"].to_list()
 
@@ -682,14 +693,87 @@ class Figure:
             #     font = dict(size = 24),
             # ),
         )
-            
+
         return fig
-    
+
+    def create_mm_trendline_rollup(self, df, grain, selected_drilldown_by, x_range):
+        """
+        Money moved trendline of a zoomed range, drawn from a TimeSeriesRollups series on a date axis.
+
+        Parameters:
+        - df (DataFrame): period_start, the drilldown column (if any) and money_moved.
+        - grain (str): "day", "week" or "month", the resolution of the series.
+        - selected_drilldown_by (str): Column with one trace per value, or None for a single trace.
+        - x_range (tuple of date): The visible range, kept on the re-aggregated figure.
+        """
+        fig = go.Figure()
+        period_format = {"day": "%d %b'%y", "week": "Week of %d %b'%y", "month": "%b'%y"}[grain]
+
+        if selected_drilldown_by:
+            for trace in df.get_column(selected_drilldown_by).unique(maintain_order = True).to_list():
+                trace_df = df.filter(pl.col(selected_drilldown_by) == trace).sort("period_start")
+
+                fig = fig.add_trace(
+                    self.create_line_trace(
+                        x_values = trace_df["period_start"],
+                        y_values = trace_df["money_moved"],
+                        markers_mode = "lines+markers",
+                        marker_size = 6,
+                        marker_color = px.colors.qualitative.Set3,
+                        text_position = "top left",
+                        name_for_legend = trace,
+                        line_width = 2,
+                        hover_template = "%{y}",
+                    )
+                )
+        else:
+            fig = fig.add_trace(
+                    self.create_line_trace(
+                        x_values = df["period_start"],
+                        y_values = df["money_moved"],
+                        markers_mode = "lines+markers",
+                        marker_size = 6,
+                        marker_color = self.colors['primary'],
+                        text_position = "top left",
+                        name_for_legend = "MM",
+                        line_color = self.colors['primary'],
+                        line_width = 2,
+                        hover_template = "$%{y:,.2f}",
+                    )
+                )
+
+        fig.update_layout(
+            hovermode = "x unified",
+            legend = dict(title = dict(text = "Select (Double-Click) / De-Select (One-Click)", side = "top center"), yanchor = "top", y = 1.1, x = 0.5, xanchor = "center", orientation = "h"),
+            template = self.plotly_template,
+            margin =  self.chart_margin,
+            xaxis = dict(
+                type = "date",
+                range = [x_range[0].isoformat(), x_range[1].isoformat()],
+                hoverformat = period_format,
+                showgrid = False,
+                zeroline = False,
+                showline = True,
+                ticks = "outside",
+                tickcolor = self.colors['secondary'],
+            ),
+            yaxis = dict(
+                tickformat = "$,.3s",
+                showgrid = False,
+                zeroline = False,
+                showline = False,
+                ticks = "outside",
+                tickcolor = self.colors['secondary'],
+            ),
+        )
+
+        return fig
+
     def create_active_pledge_arr_sankey(self, df: pl.DataFrame, view_mode: str = "actual", total_target: float = TOTAL_ARR_TARGET) -> go.Figure:
         # Group and compute actuals
         grouped = df.group_by(["pledge_chapter_type", "pledge_frequency"]).agg(
             pl.col("pledge_contribution_arr_usd").sum().alias("actual_arr")
-        ).to_pandas()
+        ).with_columns(pl.col(pl.Categorical).cast(pl.String)).to_pandas()  # Only observed values as pandas groups
 
         # Compute targets and gaps if in target mode
         if view_mode == "target":
@@ -859,7 +943,7 @@ class Figure:
 
         return fig
 
-    def create_attrition_rate_trendline(self, attrition_lf, selected_drilldown_by):
+    def create_attrition_rate_trendline(self, attrition_lf, selected_drilldown_by, input_size = None):
 
         lf = attrition_lf
 
@@ -879,9 +963,9 @@ class Figure:
                 .sort("pledge_starts_at_fm")
             )
 
-            unique_traces = data_preparer.get_col_unique_values_lf(lf, selected_drilldown_by)
-
-            df = lf.collect()
+            # One query per chart: the traces are the drilldown values of the collected frame
+            df = data_preparer.collect(lf, input_size)
+            unique_traces = df[selected_drilldown_by].drop_nulls().unique().sort().to_list()
 
             for trace in unique_traces:
                 trace_df = df.filter(pl.col(selected_drilldown_by) == trace).sort("pledge_starts_at_fm")
@@ -904,7 +988,7 @@ class Figure:
                     )
                 )
         else:
-            df = (lf
+            monthly_lf = (lf
                 .group_by(["pledge_starts_at_fm"])
                 .agg([
                     pl.sum("total_pledge_count").alias("total_pledge_count"),
@@ -915,8 +999,8 @@ class Figure:
                     (pl.col("is_cancelled_count") / pl.col("total_pledge_count")).alias("attrition_rate")
                 ])
                 .sort("pledge_starts_at_fm")
-                .collect()
             )
+            df = data_preparer.collect(monthly_lf, input_size)
 
             y_vals = df["attrition_rate"].to_list()
             x_vals = df["pledge_starts_at_fm"].to_list()
@@ -960,12 +1044,12 @@ class Figure:
             # )
                         
         # Get all unique fiscal months in correct order
-        all_months_df = (
+        all_months_df = data_preparer.collect(
             lf
             .select(["pledge_starts_at_fm", "pledge_starts_at_calendar_monthyear"])
             .unique()
-            .sort("pledge_starts_at_fm")
-            .collect()
+            .sort("pledge_starts_at_fm"),
+            input_size,
         )
 
         month_keys = all_months_df["pledge_starts_at_fm"].to_list()
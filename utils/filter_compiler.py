@@ -0,0 +1,119 @@
+import polars as pl
+
+from functools import lru_cache, reduce
+import operator
+
+# Filters are (column, operator, value) tuples, combined with ("AND", [filters]), ("OR", [filters]) and ("NOT", filter)
+COMPARISONS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+OPERATORS = set(COMPARISONS) | {"in", "not_in", "null", "not_null", "between", "starts_with", "not_starts_with"}
+GROUPS = {"AND": "and", "OR": "or", "NOT": "not"}
+
+MATCH_ALL = ("and", ())
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _normalize_leaf(col_name, op, value):
+    if op not in OPERATORS:
+        raise ValueError(f"Unsupported operator: {op}")
+
+    value = _freeze(value)
+    if op in ["null", "not_null"]:
+        value = None
+    elif op in ["in", "not_in"]:
+        if not isinstance(value, tuple):
+            return ("filter", col_name, "==" if op == "in" else "!=", value)
+        value = tuple(sorted(set(value), key = repr))
+    elif op == "between":
+        if not isinstance(value, tuple) or len(value) != 2:
+            raise ValueError(f"between expects (low, high), got {value!r}")
+    return ("filter", col_name, op, value)
+
+
+def normalize(filter_spec):
+    """
+    Returns the canonical, hashable form of a filter: nested groups of the same kind are flattened,
+    duplicates dropped and children sorted, so equivalent filters compare (and hash) equal.
+    """
+    if isinstance(filter_spec, (list, tuple)) and len(filter_spec) == 2 and filter_spec[0] in GROUPS:
+        kind, children = GROUPS[filter_spec[0]], filter_spec[1]
+        if kind == "not":
+            child = normalize(children)
+            return child[1] if child[0] == "not" else ("not", child)
+
+        flat = set()
+        for child in map(normalize, children):
+            if child[0] == kind:
+                flat.update(child[1])
+            else:
+                flat.add(child)
+        if len(flat) == 1:
+            return flat.pop()
+        return (kind, tuple(sorted(flat, key = repr)))
+
+    if isinstance(filter_spec, (list, tuple)) and len(filter_spec) == 3:
+        return _normalize_leaf(*filter_spec)
+
+    raise ValueError(f"Invalid filter: {filter_spec!r}")
+
+
+def normalize_filters(filters, logic = "AND"):
+    """
+    Canonical form of a filter_data filter list combined with `logic`.
+    """
+    if logic not in ["AND", "OR"]:
+        raise ValueError(f"Unsupported logic: {logic}")
+    return normalize((logic, filters or [])) if filters else MATCH_ALL
+
+
+def filter_columns(canonical):
+    """
+    Returns the columns a canonical filter references, in order of appearance.
+    """
+    if canonical[0] == "filter":
+        return [canonical[1]]
+    children = [canonical[1]] if canonical[0] == "not" else canonical[1]
+    return list(dict.fromkeys(col for child in children for col in filter_columns(child)))
+
+
+@lru_cache(maxsize = 4096)
+def compile_filter(canonical):
+    """
+    Compiles a canonical filter to a polars expression, once per distinct filter.
+    """
+    kind = canonical[0]
+    if kind == "not":
+        return ~compile_filter(canonical[1])
+    if kind in ["and", "or"]:
+        if not canonical[1]:
+            return pl.lit(kind == "and")
+        return reduce(operator.and_ if kind == "and" else operator.or_, map(compile_filter, canonical[1]))
+
+    _, col_name, op, value = canonical
+    col = pl.col(col_name)
+    if op in COMPARISONS:
+        return COMPARISONS[op](col, value)
+    if op == "in":
+        return col.is_in(list(value))
+    if op == "not_in":
+        return ~col.is_in(list(value))
+    if op == "null":
+        return col.is_null()
+    if op == "not_null":
+        return col.is_not_null()
+    if op == "between":
+        return col.is_between(value[0], value[1], closed = "both")
+    if op == "starts_with":
+        return col.cast(pl.String).str.starts_with(value)
+    return ~col.cast(pl.String).str.starts_with(value)
@@ -0,0 +1,114 @@
+import polars as pl
+import numpy as np
+
+from datetime import date, timedelta
+
+FY_START_MONTH = 7  # Fiscal years run July to June and are labelled "FY2024-2025"
+
+class FiscalCalendar:
+    """
+    Precomputed fiscal date dimension with integer keys, and O(1) fiscal year / prior period lookups.
+    """
+    def __init__(self, first_fy = 2000, last_fy = 2050):
+        self.first_fy = first_fy
+        self.last_fy = last_fy
+        self.start = date(first_fy, FY_START_MONTH, 1)
+        self.end = date(last_fy + 1, FY_START_MONTH, 1) - timedelta(days = 1)
+
+        self.dates = self._build_dimension()
+
+        # Lookup arrays, indexed by fy_key - first_fy or by days since self.start
+        self.fy_labels = [self.fy_label(fy) for fy in range(first_fy, last_fy + 1)]
+        self.fy_keys = {label: fy for fy, label in zip(range(first_fy, last_fy + 1), self.fy_labels)}
+        self._fy_start_days = np.array([(date(fy, FY_START_MONTH, 1) - self.start).days for fy in range(first_fy, last_fy + 2)])
+        self._fy_by_day = self.dates.get_column("fy_key").to_numpy()
+        self._day_of_fy_by_day = self.dates.get_column("day_of_fy").to_numpy()
+
+    def _build_dimension(self):
+        """
+        One row per day: the calendar and fiscal attributes used across the datasets, plus integer keys
+        (fy_key is the year the FY starts in, day_of_fy counts from 0 on 1 July).
+        """
+        day = pl.col("date")
+        fy_key = pl.when(day.dt.month() >= FY_START_MONTH).then(day.dt.year()).otherwise(day.dt.year() - 1)
+
+        return (pl.DataFrame({"date": pl.date_range(self.start, self.end, eager = True)})
+            .with_columns(fy_key.cast(pl.Int16).alias("fy_key"))
+            .with_columns([
+                day.dt.year().alias("calendar_year"),
+                day.dt.month().cast(pl.Int8).alias("calendar_month"),
+                day.dt.strftime("%b").alias("calendar_monthname"),
+                day.dt.strftime("%b'%y").alias("calendar_monthyear"),
+                pl.format("FY{}-{}", pl.col("fy_key"), pl.col("fy_key") + 1).alias("fy"),
+                ((day.dt.month() - FY_START_MONTH) % 12 + 1).cast(pl.Int8).alias("fm"),
+                ((day.dt.day() - 1) // 7 + 1).cast(pl.Int8).alias("week_of_month"),
+                day.dt.weekday().cast(pl.Int8).alias("day_of_week"),
+                day.dt.week().cast(pl.Int32).alias("week_of_year"),
+                (day - pl.date(pl.col("fy_key"), FY_START_MONTH, 1)).dt.total_days().alias("__days_into_fy"),
+            ])
+            .with_columns([
+                (pl.col("__days_into_fy") // 7 + 1).cast(pl.Int64).alias("week_of_fy"),
+                pl.col("__days_into_fy").cast(pl.Int16).alias("day_of_fy"),
+                ((pl.col("fy_key").cast(pl.Int32) - self.first_fy) * 12 + pl.col("fm") - 1).cast(pl.Int16).alias("fiscal_month_key"),
+            ])
+            .drop("__days_into_fy")
+        )
+
+    def date_dimension(self, prefix):
+        """
+        Returns the dimension with columns named like the datasets' date columns,
+        e.g. prefix "payment_date" gives payment_date, payment_date_fy, payment_date_fm, ...
+        """
+        return self.dates.rename({col: prefix if col == "date" else f"{prefix}_{col}" for col in self.dates.columns})
+
+    @staticmethod
+    def fy_label(fy_key):
+        return f"FY{fy_key}-{fy_key + 1}"
+
+    def fy_key(self, fy_label):
+        if fy_label not in self.fy_keys:
+            raise ValueError(f"Unknown fiscal year: {fy_label}")
+        return self.fy_keys[fy_label]
+
+    def prior_fy(self, fy_label, years = 1):
+        """
+        Returns the label of the fiscal year `years` before the given one, e.g. "FY2023-2024" for "FY2024-2025".
+        Raises ValueError when that year is before the start of the calendar.
+        """
+        index = self.fy_key(fy_label) - years - self.first_fy
+        if not 0 <= index < len(self.fy_labels):
+            raise ValueError(f"Fiscal year {years} year(s) before {fy_label} is outside the fiscal calendar")
+        return self.fy_labels[index]
+
+    def _day_index(self, day):
+        index = (day - self.start).days
+        if not 0 <= index < len(self._fy_by_day):
+            raise ValueError(f"Date outside the fiscal calendar: {day}")
+        return index
+
+    def fy_of(self, day):
+        """
+        Returns the fiscal year key (the year it starts in) of a date.
+        """
+        return int(self._fy_by_day[self._day_index(day)])
+
+    def day_of_fy(self, day):
+        """
+        Returns the number of days since the start of the date's fiscal year (0 on 1 July).
+        """
+        return int(self._day_of_fy_by_day[self._day_index(day)])
+
+    def same_day_prior_fy(self, day, years = 1):
+        """
+        Returns the date at the same point of the fiscal year `years` earlier. Day 366 of a leap
+        fiscal year maps to the last day of a shorter one.
+        """
+        fy_index = self.fy_of(day) - self.first_fy - years
+        if fy_index < 0:
+            raise ValueError(f"Date outside the fiscal calendar: {day}")
+        fy_length = self._fy_start_days[fy_index + 1] - self._fy_start_days[fy_index]
+        offset = self._fy_start_days[fy_index] + min(self.day_of_fy(day), fy_length - 1)
+        return self.start + timedelta(days = int(offset))
+
+
+fiscal_calendar = FiscalCalendar()
@@ -0,0 +1,75 @@
+from collections import OrderedDict
+import os
+import threading
+
+# Set OFTW_QUERY_CACHE_MB to a memory budget to cache filter_data results (off by default). Cached results are
+# collected eagerly and only refreshed when the data version moves, so enable it together with OFTW_WATCH_INTERVAL
+QUERY_CACHE_MB = float(os.getenv("OFTW_QUERY_CACHE_MB", "0"))
+
+
+class QueryCache:
+    """
+    LRU cache of collected query results under a memory budget, measured with DataFrame.estimated_size().
+    Keys include the dataset's data version, so a reload never serves stale results; old entries age out.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()   # key -> DataFrame, least recently used first
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def make_key(dataset_name, canonical_filter, columns, data_version):
+        """
+        Builds the key of a query from its canonical filter (see utils.filter_compiler), in which
+        equivalent filters compare equal.
+        """
+        return (dataset_name, canonical_filter, tuple(columns) if columns else None, data_version)
+
+    def get(self, key):
+        with self._lock:
+            df = self.entries.get(key)
+            if df is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return df
+
+    def put(self, key, df):
+        size = df.estimated_size()
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key).estimated_size()
+            self.entries[key] = df
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last = False)
+                self.size -= evicted.estimated_size()
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+query_cache = QueryCache(int(QUERY_CACHE_MB * 1024 * 1024))
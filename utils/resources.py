@@ -0,0 +1,155 @@
+"""
+CPU budget of a worker process. Polars sizes its thread pool once, from POLARS_MAX_THREADS, when it is
+first used, so configure_threads() must run before the app imports polars (see app.py).
+"""
+from contextlib import contextmanager
+import math
+import os
+import shlex
+import sys
+import threading
+
+# Set OFTW_WORKERS to the number of gunicorn workers sharing the machine (gunicorn.conf.py sets it from
+# the gunicorn settings) and OFTW_POLARS_THREADS to override the per-worker polars thread count derived from it
+POLARS_THREADS = os.getenv("OFTW_POLARS_THREADS")
+
+# Queries estimated to read more than OFTW_HEAVY_QUERY_MB count as heavy; at most OFTW_HEAVY_QUERY_SLOTS
+# of them run at once per worker, each with the whole polars pool, while cheap queries are never queued
+HEAVY_QUERY_MB = float(os.getenv("OFTW_HEAVY_QUERY_MB", "64"))
+HEAVY_QUERY_SLOTS = int(os.getenv("OFTW_HEAVY_QUERY_SLOTS", "1"))
+
+# Set OFTW_PIN_WORKERS=1 to pin each gunicorn worker to its own share of the CPUs (see gunicorn.conf.py)
+PIN_WORKERS = os.getenv("OFTW_PIN_WORKERS", "0") == "1"
+
+CGROUP_V2_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+CGROUP_V1_QUOTA = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+CGROUP_V1_PERIOD = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+
+
+def _read(path):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_quota():
+    """
+    Returns the container's CPU quota in CPUs (e.g. 1.5), or None when it is unlimited or unknown.
+    """
+    cpu_max = _read(CGROUP_V2_CPU_MAX)
+    if cpu_max:
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max" and period:
+            return int(quota) / int(period)
+        return None
+
+    quota, period = _read(CGROUP_V1_QUOTA), _read(CGROUP_V1_PERIOD)
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def available_cpus():
+    """
+    Returns the CPUs this process may use: its affinity set, capped by the cgroup quota.
+    """
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    quota = cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, max(1, math.floor(quota)))
+    return cpus
+
+
+def worker_count():
+    """
+    Returns the number of gunicorn workers: OFTW_WORKERS, else WEB_CONCURRENCY or the --workers
+    option of GUNICORN_CMD_ARGS, which gunicorn reads too; 1 otherwise.
+    """
+    # Read at call time: gunicorn sets it after this module was imported by its config
+    if os.getenv("OFTW_WORKERS"):
+        return max(1, int(os.getenv("OFTW_WORKERS")))
+    if os.getenv("WEB_CONCURRENCY"):
+        return max(1, int(os.getenv("WEB_CONCURRENCY")))
+
+    args = shlex.split(os.getenv("GUNICORN_CMD_ARGS", ""))
+    for i, arg in enumerate(args):
+        if arg in ["-w", "--workers"] and i + 1 < len(args):
+            return max(1, int(args[i + 1]))
+        if arg.startswith("--workers="):
+            return max(1, int(arg.split("=", 1)[1]))
+    return 1
+
+
+def polars_threads():
+    """
+    Returns the per-worker polars thread count: the available CPUs split evenly between the workers.
+    """
+    if POLARS_THREADS:
+        return max(1, int(POLARS_THREADS))
+    return max(1, available_cpus() // worker_count())
+
+
+def configure_threads():
+    """
+    Sets POLARS_MAX_THREADS for this worker, unless it was set explicitly. Returns the thread count.
+    """
+    if "POLARS_MAX_THREADS" in os.environ:
+        return int(os.environ["POLARS_MAX_THREADS"])
+    if "polars" in sys.modules:
+        print("Polars was imported before the CPU budget was set; its thread pool may use every core.")
+
+    threads = polars_threads()
+    os.environ["POLARS_MAX_THREADS"] = str(threads)
+    return threads
+
+
+def worker_cpus(worker_index, workers = None):
+    """
+    Returns the CPU set of the `worker_index`-th worker when the available CPUs are split into equal,
+    contiguous shares (workers share CPUs round-robin when there are more workers than CPUs).
+    """
+    cpus = sorted(os.sched_getaffinity(0))[:available_cpus()]
+    workers = workers or worker_count()
+    share = max(1, len(cpus) // workers)
+    start = (worker_index % max(1, len(cpus) // share)) * share
+    return set(cpus[start:start + share])
+
+
+def pin_worker(worker_index, workers = None):
+    """
+    Restricts the current process to its worker_cpus share. Returns the CPU set, or None where
+    affinity is not supported.
+    """
+    if not hasattr(os, "sched_setaffinity"):
+        return None
+    cpus = worker_cpus(worker_index, workers)
+    os.sched_setaffinity(0, cpus)
+    return cpus
+
+
+_query_slots = threading.BoundedSemaphore(max(1, HEAVY_QUERY_SLOTS))
+
+
+def query_class(input_size):
+    """
+    Classifies a query as "cheap" or "heavy" from its estimated input size in bytes.
+    """
+    if input_size is not None and input_size > HEAVY_QUERY_MB * 1024 * 1024:
+        return "heavy"
+    return "cheap"
+
+
+@contextmanager
+def query_slot(input_size):
+    """
+    Runs the block as a query of the given estimated input size: heavy queries wait for one of the
+    HEAVY_QUERY_SLOTS, so concurrent sessions never split the worker's polars pool between several large scans.
+    """
+    if query_class(input_size) == "cheap":
+        yield
+        return
+
+    with _query_slots:
+        yield
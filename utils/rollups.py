@@ -0,0 +1,245 @@
+import polars as pl
+import numpy as np
+
+from datetime import date, datetime, timedelta
+import threading
+
+from utils.data_loader import data_loader
+from utils.cancellation import shielded
+from utils.data_preparer import DataPreparer
+from utils.fiscal_calendar import fiscal_calendar, FY_START_MONTH
+
+ROLLUP_DIMENSIONS = ["payment_platform", "pledge_chapter_type", "payment_portfolio"]
+ROLLUP_MEASURES = ["payment_amount_usd", "payment_cf_amount_usd"]
+
+# Resolutions from finest to coarsest, with their approximate length in days
+GRAINS = {"day": 1, "week": 7, "month": 365.25 / 12}
+
+# Most points a series may show before the next coarser resolution is used
+MAX_POINTS = 93
+
+DAYS_PER_FY = 366
+
+data_preparer = DataPreparer()
+
+
+class TimeSeriesRollups:
+    """
+    Money moved per FY at day, week-of-FY and month resolution, broken down by the rollup dimensions.
+    Built once per data version of merged; every series is then a re-aggregation of a few thousand rows.
+    Each period is labelled by its start date (weeks start on the FY's 1 July weekday).
+    """
+    def __init__(self, dataset_name = "merged"):
+        self.dataset_name = dataset_name
+        self.version = None
+        self.rollups = {}   # grain -> DataFrame [payment_date_fy, period_start, *dimensions, *measures]
+        self.prefix_sums = {}   # FY label -> (cells DataFrame, cumulative array [cell, day_of_fy, measure], last day_of_fy)
+        self._lock = threading.Lock()
+
+    def _build(self):
+        keys = ["payment_date_fy", "period_start"] + ROLLUP_DIMENSIONS
+        day_of_fy = fiscal_calendar.date_dimension("payment_date").select(["payment_date", "payment_date_day_of_fy"])
+
+        columns = ["payment_date_fy", "payment_date"] + ROLLUP_DIMENSIONS + ROLLUP_MEASURES
+        days = data_preparer.collect(data_loader.get_data(self.dataset_name, columns = columns)
+                .filter(pl.col("payment_date").is_not_null())
+                .with_columns(pl.col(pl.Categorical).cast(pl.String))
+                .group_by(["payment_date_fy", "payment_date"] + ROLLUP_DIMENSIONS)
+                .agg([pl.col(measure).sum() for measure in ROLLUP_MEASURES])
+                .join(day_of_fy.lazy(), on = "payment_date", how = "left"),
+            input_size = data_loader.estimate_size(self.dataset_name, columns = columns),
+        )
+        self.prefix_sums = self._build_prefix_sums(days)
+
+        period_starts = {
+            "day": pl.col("payment_date"),
+            "week": pl.col("payment_date") - pl.duration(days = pl.col("payment_date_day_of_fy").cast(pl.Int64) % 7),
+            "month": pl.col("payment_date").dt.month_start(),
+        }
+        return {
+            grain: (days
+                .with_columns(period_start.alias("period_start"))
+                .group_by(keys)
+                .agg([pl.col(measure).sum() for measure in ROLLUP_MEASURES])
+                .sort(keys, nulls_last = True)
+            )
+            for grain, period_start in period_starts.items()
+        }
+
+    @staticmethod
+    def _build_prefix_sums(days):
+        """
+        Running FY-to-date totals of every dimension cell: the [cell, n] entry of a FY's array holds the
+        sums of the measures from 1 July to day n, so an as-of-date total is one lookup per cell.
+        """
+        prefix_sums = {}
+        for (fy,), fy_days in days.partition_by("payment_date_fy", as_dict = True, include_key = True).items():
+            if fy is None:
+                continue
+            cells = fy_days.select(ROLLUP_DIMENSIONS).unique(maintain_order = True).with_row_index("__cell")
+            fy_days = fy_days.join(cells, on = ROLLUP_DIMENSIONS, how = "left", nulls_equal = True)
+
+            daily = np.zeros((cells.height, DAYS_PER_FY, len(ROLLUP_MEASURES)))
+            cell_index = fy_days.get_column("__cell").to_numpy()
+            day_index = fy_days.get_column("payment_date_day_of_fy").to_numpy()
+            for i, measure in enumerate(ROLLUP_MEASURES):
+                np.add.at(daily[:, :, i], (cell_index, day_index), fy_days.get_column(measure).fill_null(0).to_numpy())
+
+            prefix_sums[fy] = (cells, daily.cumsum(axis = 1), int(day_index.max()))
+        return prefix_sums
+
+    def get_rollups(self):
+        version = data_loader.get_data_version(self.dataset_name)
+        with self._lock:
+            if self.version != version:
+                # Shared by every session, so a cancelled request doesn't abandon the build
+                with shielded():
+                    self.rollups = self._build()
+                self.version = version
+            return self.rollups
+
+    def last_day_of_fy(self, fy):
+        """
+        Returns the day_of_fy of the latest payment in the FY (its as-of date), or None without payments.
+        """
+        self.get_rollups()
+        entry = self.prefix_sums.get(fy)
+        return entry[2] if entry else None
+
+    def fytd(self, fy, day_of_fy, measure, exclude_portfolios = None):
+        """
+        Returns the FY-to-date sum of a measure as of day `day_of_fy` (0 on 1 July) of the FY, from the prefix sums.
+        Later days of a shorter FY count as its last day; a FY without payments sums to 0.
+        """
+        if measure not in ROLLUP_MEASURES:
+            raise ValueError(f"Unsupported measure: {measure}")
+
+        self.get_rollups()
+        entry = self.prefix_sums.get(fy)
+        if entry is None:
+            return 0.0
+
+        cells, cumulative, _ = entry
+        day_index = min(max(day_of_fy, 0), DAYS_PER_FY - 1)
+        values = cumulative[:, day_index, ROLLUP_MEASURES.index(measure)]
+        if exclude_portfolios:
+            values = values[~cells.get_column("payment_portfolio").is_in(exclude_portfolios).to_numpy()]
+        return float(values.sum())
+
+    def fytd_vs_prior(self, fy, measure, exclude_portfolios = None):
+        """
+        Like-for-like FY-to-date comparison: the FY's total as of its latest payment, and the prior FY's total
+        as of the same point of its year.
+
+        Returns:
+        - tuple: (fytd value, prior FY value as of the same day, as-of date), or None when the FY has no payments.
+        """
+        last_day = self.last_day_of_fy(fy)
+        if last_day is None:
+            return None
+
+        fy_start = date(fiscal_calendar.fy_key(fy), FY_START_MONTH, 1)
+        as_of = fy_start + timedelta(days = last_day)
+        prior_day = fiscal_calendar.day_of_fy(fiscal_calendar.same_day_prior_fy(as_of))
+        return (
+            self.fytd(fy, last_day, measure, exclude_portfolios),
+            self.fytd(fiscal_calendar.prior_fy(fy), prior_day, measure, exclude_portfolios),
+            as_of,
+        )
+
+    def pick_grain(self, start, end):
+        """
+        Returns the finest resolution that shows at most MAX_POINTS periods between the two dates.
+        """
+        span = (end - start).days + 1
+        for grain, days in GRAINS.items():
+            if span / days <= MAX_POINTS:
+                return grain
+        return "month"
+
+    def series(self, fy, grain, measure, drilldown_by = None, exclude_portfolios = None, start = None, end = None):
+        """
+        Returns [period_start, (drilldown_by), money_moved] for one FY at the given resolution,
+        optionally limited to the periods overlapping [start, end].
+        """
+        if grain not in GRAINS:
+            raise ValueError(f"Unsupported grain: {grain}")
+        if measure not in ROLLUP_MEASURES:
+            raise ValueError(f"Unsupported measure: {measure}")
+
+        df = self.get_rollups()[grain].filter(pl.col("payment_date_fy") == fy)
+        if exclude_portfolios:
+            df = df.filter(~pl.col("payment_portfolio").is_in(exclude_portfolios))
+        if start is not None:
+            df = df.filter(pl.col("period_start") > start - timedelta(days = GRAINS[grain]))
+        if end is not None:
+            df = df.filter(pl.col("period_start") <= end)
+
+        keys = ["period_start"] + ([drilldown_by] if drilldown_by else [])
+        return (df
+            .group_by(keys)
+            .agg(pl.col(measure).sum().alias("money_moved"))
+            .sort(keys, nulls_last = True)
+        )
+
+    @staticmethod
+    def plotted_categories(figure):
+        """
+        Returns the month labels ("Jul'24") of a figure's category x axis, in the order plotly lays them out
+        (first appearance across the traces), or None when the axis is not a category axis of months.
+        """
+        if not figure or figure.get("layout", {}).get("xaxis", {}).get("type") == "date":
+            return None
+
+        categories = []
+        for trace in figure.get("data", []):
+            x_values = trace.get("x")
+            if not isinstance(x_values, list):
+                return None
+            categories += [x for x in x_values if x not in categories]
+        try:
+            return [datetime.strptime(label, "%b'%y").date() for label in categories] or None
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def visible_range(relayout_data, fy, categories = None):
+        """
+        Reads the zoomed x range of a figure's relayoutData as (start, end) dates, or None when the
+        axis is autoranged. Category axes (the monthly view) report positions, mapped through the months
+        plotted on the axis (see plotted_categories), or read as FY month indices when those are unknown.
+        """
+        if not relayout_data or relayout_data.get("xaxis.autorange"):
+            return None
+
+        bounds = relayout_data.get("xaxis.range")
+        if bounds is None and "xaxis.range[0]" in relayout_data:
+            bounds = [relayout_data["xaxis.range[0]"], relayout_data.get("xaxis.range[1]")]
+        if not bounds or None in bounds:
+            return None
+
+        fy_start = date(fiscal_calendar.fy_key(fy), FY_START_MONTH, 1)
+        fy_end = date(fy_start.year + 1, FY_START_MONTH, 1) - timedelta(days = 1)
+
+        def month_end(month_start):
+            return date(month_start.year + month_start.month // 12, month_start.month % 12 + 1, 1) - timedelta(days = 1)
+
+        def position(value, count):
+            return min(max(int(value + 0.5), 0), count - 1)
+
+        if all(isinstance(value, (int, float)) for value in bounds):
+            if not categories:
+                categories = [date(fy_start.year + (FY_START_MONTH - 1 + i) // 12, (FY_START_MONTH - 1 + i) % 12 + 1, 1) for i in range(12)]
+            # Plotly orders the categories by first appearance across the traces, which need not be by date
+            shown = categories[position(bounds[0], len(categories)):position(bounds[1], len(categories)) + 1]
+            if not shown:
+                return None
+            start, end = min(shown), month_end(max(shown))
+        else:
+            start, end = date.fromisoformat(str(bounds[0])[:10]), date.fromisoformat(str(bounds[1])[:10])
+
+        start, end = max(start, fy_start), min(end, fy_end)
+        return (start, end) if start <= end else None
+
+
+money_moved_rollups = TimeSeriesRollups()
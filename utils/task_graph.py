@@ -0,0 +1,101 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import contextvars
+import os
+import threading
+
+from utils.cancellation import check_cancelled
+
+# Set OFTW_CHART_THREADS to the size of the process-wide pool running chart computations (1 runs them in sequence)
+CHART_THREADS = int(os.getenv("OFTW_CHART_THREADS", str(min(4, os.cpu_count() or 1))))
+
+THREAD_NAME_PREFIX = "chart"
+
+chart_pool = ThreadPoolExecutor(max_workers = max(CHART_THREADS, 1), thread_name_prefix = THREAD_NAME_PREFIX)
+
+
+class TaskGraph:
+    """
+    Named computations with dependencies, run concurrently on the shared chart pool.
+
+    A task starts as soon as the tasks it depends on are done, and is called with their results as
+    positional arguments, in the order they were declared. Polars collects release the GIL, so
+    independent queries overlap and a callback takes about as long as its slowest chain of tasks.
+    """
+    def __init__(self):
+        self.tasks = {}     # name -> (function, dependency names)
+
+    def add(self, name, fn, deps = ()):
+        if name in self.tasks:
+            raise ValueError(f"Duplicate task: {name}")
+        self.tasks[name] = (fn, tuple(deps))
+        return self
+
+    def _check(self):
+        """
+        Raises ValueError on unknown dependencies or cycles.
+        """
+        state = {}  # name -> "visiting" / "done"
+
+        def visit(name, path):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Cyclic task dependencies: {' -> '.join(path + [name])}")
+            state[name] = "visiting"
+            for dep in self.tasks[name][1]:
+                if dep not in self.tasks:
+                    raise ValueError(f"Task '{name}' depends on unknown task '{dep}'")
+                visit(dep, path + [name])
+            state[name] = "done"
+
+        for name in self.tasks:
+            visit(name, [])
+
+    def run(self, pool = None):
+        """
+        Runs every task and returns {name: result}. The first failing task's exception is raised
+        once the running tasks finish; tasks not yet started are skipped. Tasks run with the caller's
+        cancellation token, and none are started once it is cancelled (see utils.cancellation).
+        """
+        self._check()
+        pool = pool or chart_pool
+        results = {}
+
+        # Tasks already running on the pool would wait for workers that may never free up, so a graph
+        # started from inside a task (or with a single thread) runs in the calling thread
+        if CHART_THREADS <= 1 or threading.current_thread().name.startswith(THREAD_NAME_PREFIX):
+            pending = dict(self.tasks)
+            while pending:
+                name = next(name for name, (_, deps) in pending.items() if all(dep in results for dep in deps))
+                fn, deps = pending.pop(name)
+                check_cancelled()
+                results[name] = fn(*[results[dep] for dep in deps])
+            return results
+
+        pending = dict(self.tasks)
+        running = {}    # future -> name
+        error = None
+
+        while pending or running:
+            if error is None:
+                try:
+                    check_cancelled()
+                    for name in [name for name, (_, deps) in pending.items() if all(dep in results for dep in deps)]:
+                        fn, deps = pending.pop(name)
+                        running[pool.submit(contextvars.copy_context().run, fn, *[results[dep] for dep in deps])] = name
+                except Exception as e:
+                    error = e
+            if error is not None and not running:
+                break
+
+            done, _ = wait(running, return_when = FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                if future.exception() is not None:
+                    error = error or future.exception()
+                else:
+                    results[name] = future.result()
+
+        if error is not None:
+            raise error
+        return results